@@ -1,12 +1,38 @@
 from arcade import Sprite, SpriteSolidColor
 import arcade, arcade.color
-from constants import OBJ_SIZE, DT, SCREEN_HEIGHT, SCREEN_WIDTH
-from dataclasses import dataclass
+from constants import (
+    OBJ_SIZE,
+    DT,
+    SCREEN_HEIGHT,
+    SCREEN_WIDTH,
+    INTERACTION_RADIUS,
+    MAX_PER_TYPE,
+)
+from collections import deque
 from enum import Enum
 from random import Random
-from typing import Optional, List, Callable, Type, TypeVar, cast, Sequence
+from typing import (
+    Optional,
+    List,
+    Callable,
+    Type,
+    TypeVar,
+    cast,
+    Sequence,
+    Dict,
+    Iterable,
+    Tuple,
+    Deque,
+    Any,
+)
 from arcade.arcade_types import Vector
 from common import len2, max_norm
+from spatial import SpatialGrid
+from bars import BarBatch, BAR_HEIGHT
+from profiler import PROFILER
+from events import EventBus, Birth, Death, Ate, Attack, Cap
+from timers import Timer, TimerQueue
+from textures import get_texture, preload
 
 R: Random = Random(2014)
 
@@ -18,19 +44,69 @@ def simple_gauss(mean: float) -> float:
 T = TypeVar("T", bound="Agent")
 
 SHOW_BARS = False
+# Seconds a dead agent waits before it is reused. States keep their target
+# until they see it died, the longest being an attack cooldown, 1.2s.
+POOL_QUARANTINE = 2.0
 
 
+# Left and top of an unrotated sprite of each type centered at (0, 0). Both
+# come from the hit box, which is slow to compute for every new sprite.
+CORNERS: Dict[Type["Agent"], Tuple[float, float]] = {}
+
+
+# The fields of the simulation are slots. The instance dict then only has the
+# fields of the Sprite, few enough for Python to share its keys between all
+# the instances, which makes it several times smaller. Class attributes are
+# the parameters shared by a type.
 class Agent(Sprite):
+    __slots__ = ("map", "type", "base_force", "batched", "max_speed")
     map: "Map"
-    max_speed: float = 100.0
-
-    def __init__(self, map, left, top, *args, type, **kwargs):
-        super().__init__(*args, **kwargs, hit_box_algorithm="Simple")
-        self.left = left
-        self.top = top
+    image: str
+    default_max_speed: float = 100.0
+    max_speed: float
+    # Never moves, so Map.update skips its motion and bounds, and only updates
+    # it while it is awake
+    static: bool = False
+    # Set by Map.kernel once it moved the agent for this tick, see kernels.py
+    batched: bool
+
+    def __init__(self, map, left, top, *, type, **kwargs):
+        self.init_sprite(map, type)
+        self.reset(left, top, **kwargs)
+
+    def init_sprite(self, map: "Map", type: Type["Agent"]) -> None:
+        super().__init__(
+            scale=OBJ_SIZE / 128,
+            texture=get_texture(self.image),
+            hit_box_algorithm="Simple",
+        )
         self.map = map
         self.type = type
+        self.batched = False
+
+    # An agent without the fields reset would set or its timers, for callers
+    # that set all of them themselves, like checkpoint.restore_agent
+    @classmethod
+    def blank(cls: Type[T], map: "Map", type: Type["Agent"]) -> T:
+        agent = cls.__new__(cls)
+        agent.init_sprite(map, type)
+        return agent
+
+    # Starts a new life, which Map.create_agent also does with dead agents.
+    # Each subclass sets and randomizes its own state here, after its parent.
+    def reset(self, left, top) -> None:
+        self.angle = 0
+        corner = CORNERS.get(self.type)
+        if corner is None:
+            self.position = (0, 0)
+            corner = CORNERS[self.type] = (self.left, self.top)
+        # The same float math the left and top setters do from (0, 0)
+        self.position = (left - corner[0], top - corner[1])
+        self.velocity = [0, 0]
+        self.force = [0, 0]
         self.base_force = [0.0, 0.0]
+        self.max_speed = self.default_max_speed
+        self.batched = False
 
     # If this returned a list we could have a pretty drawing
     def calculate_external_force(self) -> Vector:
@@ -44,8 +120,20 @@ class Agent(Sprite):
     def hitbox_height(self) -> float:
         return self.top - self.bottom
 
+    # Nothing changes until something wakes it, see Map.wake
+    def is_idle(self) -> bool:
+        return False
+
     def update(self) -> None:
+        if self.static:
+            return
+        # Map.kernel already moved it this tick
+        if self.batched:
+            self.batched = False
+            return
+        start = PROFILER.start()
         external_force = self.calculate_external_force()
+        PROFILER.stop("forces", self.type, start)
         self.velocity[0] += (self.base_force[0] + external_force[0]) * DT
         self.velocity[1] += (self.base_force[1] + external_force[1]) * DT
         max_norm(self.velocity, self.max_speed)
@@ -55,16 +143,42 @@ class Agent(Sprite):
 
         super().update()
 
+    def kill(self) -> None:
+        start = PROFILER.start()
+        self.map.grids[self.type].remove(self)
+        if self.static:
+            self.map.awake[self.type].pop(self, None)
+        super().kill()
+        PROFILER.stop("kill", self.type, start)
+
+    # Picks one with probability proportional to the inverse of its squared
+    # distance, among all the agents or only those at most max_dist away
     def find_close(
-        self, agent: Type[T], filter_fn: Optional[Callable[[T], bool]] = None
+        self,
+        agent: Type[T],
+        filter_fn: Optional[Callable[[T], bool]] = None,
+        max_dist: Optional[float] = None,
     ) -> Optional[T]:
-        all = list(filter(filter_fn, cast(List[T], self.map.agents(agent))))
-        distances = [arcade.get_distance_between_sprites(self, s) ** 2 for s in all]
+        start = PROFILER.start()
+        if max_dist is None:
+            found = cast(
+                Optional[T],
+                self.map.grids[agent].pick(self.center_x, self.center_y, R, filter_fn),
+            )
+            PROFILER.stop("find_close", self.type, start)
+            return found
+        (all, distances) = self.map.neighbours(self, agent, max_dist)
+        if filter_fn is not None:
+            kept = [i for i, s in enumerate(all) if filter_fn(s)]
+            all = [all[i] for i in kept]
+            distances = [distances[i] for i in kept]
         if len(distances) > 0:
-            mn = min(distances)
-            choice = R.choices(all, [mn / d for d in distances])
+            # Anything closer than 1 counts as 1 away, so 0 is fine
+            choice = R.choices(all, [1 / max(d, 1.0) for d in distances])
             if len(choice) > 0:
+                PROFILER.stop("find_close", self.type, start)
                 return choice[0]
+        PROFILER.stop("find_close", self.type, start)
         return None
 
 
@@ -78,27 +192,20 @@ class DeathReason(Enum):
 
 
 class AgentWithHealth(Agent):
-    health = 100.0
+    __slots__ = ("health",)
+    health: float
     health_regen = 0.0
     health_bar_color = arcade.color.GREEN
 
-    def __init__(self, *args, **kwargs):
-        self.health = kwargs.pop("health", 100.0)
-        super().__init__(*args, **kwargs)
+    def reset(self, *args, health: float = 100.0, **kwargs) -> None:
+        super().reset(*args, **kwargs)
+        self.health = health
 
-    def draw(self, **kwargs):
-        super().draw(**kwargs)
-        if not SHOW_BARS:
-            return
-        health_bar_width = self.hitbox_width * (self.health / 100)
-        health_bar_height = 5
-        health_bar_x = self.left + health_bar_width / 2
-        health_bar_y = self.top + health_bar_height / 2
-        arcade.draw_rectangle_filled(
-            health_bar_x,
-            health_bar_y,
-            health_bar_width,
-            health_bar_height,
+    def add_bars(self, bars: BarBatch) -> None:
+        bars.add(
+            self.left,
+            self.top,
+            self.hitbox_width * (self.health / 100),
             self.health_bar_color,
         )
 
@@ -109,8 +216,17 @@ class AgentWithHealth(Agent):
     def remove_health(self, damage: float) -> float:
         health_drop = min(self.health, damage)
         self.health -= health_drop
+        if self.static:
+            self.map.wake(self)
         return health_drop
 
+    # Dead agents go back to the map's pool, the ones removed alive might
+    # still be targets and are left alone
+    def kill(self) -> None:
+        if self.is_dead and len(self.sprite_lists) > 0:
+            self.map.release(self)
+        super().kill()
+
     def add_health(self, amount: float) -> float:
         if self.health <= 0:
             return 0
@@ -129,27 +245,27 @@ class AgentWithHealth(Agent):
         super().update()
         if self.health <= 0:
             reason = self.death_reason()
-            # print("%s died of %s" % (self, reason.value))
+            self.map.events.emit(Death, self.type, reason)
             self.on_death(reason)
         else:
             self.add_health(self.health_regen * DT)
 
 
 class Carcass(AgentWithHealth):
+    static = True
     health_regen = 0
     mean_rot_speed: float = 4
+    __slots__ = ("original", "rot_speed", "total_rotted")
     original: Type[Agent]
-    total_rotted: float = 0
+    rot_speed: float
+    total_rotted: float
+    image = ":resources:images/enemies/wormGreen_dead.png"
 
-    def __init__(self, *args, original: Type[Agent], **kwargs):
+    def reset(self, *args, original: Type[Agent], **kwargs) -> None:
         self.original = original
         self.rot_speed = simple_gauss(self.mean_rot_speed)
-        super().__init__(
-            *args,
-            ":resources:images/enemies/wormGreen_dead.png",
-            scale=OBJ_SIZE / 128,
-            **kwargs,
-        )
+        self.total_rotted = 0
+        super().reset(*args, **kwargs)
 
     def update(self):
         self.total_rotted += self.remove_health(self.rot_speed * DT)
@@ -169,64 +285,74 @@ class Carcass(AgentWithHealth):
 
 class AgentWithAge(AgentWithHealth):
     mean_age: float = 100.0
+    __slots__ = ("death_time", "age_timer")
+    # Map time of death by old age, only scheduled if it is in the future
+    death_time: float
+    age_timer: Optional[Timer]
+
+    def reset(self, *args, **kwargs) -> None:
+        super().reset(*args, **kwargs)
+        age = R.gauss(self.mean_age, self.mean_age / 4)
+        self.death_time = self.map.time + age
+        self.age_timer = None
+        if age > 0:
+            self.age_timer = self.map.timers.schedule(age, self.die_of_age)
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.age_left: float = R.gauss(self.mean_age, self.mean_age / 4)
+    @property
+    def age_left(self) -> float:
+        return self.death_time - self.map.time
 
-    def update(self):
-        if self.age_left > 0:
-            self.age_left -= DT
-            if self.age_left <= 0:
-                print(f"{self} dies of old age")
-                self.health = 0
-        super().update()
+    def die_of_age(self) -> None:
+        self.health = 0
+        self.map.wake(self)
+
+    def kill(self) -> None:
+        if self.age_timer is not None:
+            self.map.timers.cancel(self.age_timer)
+        super().kill()
 
     def death_reason(self) -> DeathReason:
         return super().death_reason() if self.age_left > 0 else DeathReason.OldAge
 
 
 class Grass(AgentWithAge):
+    static = True
     health_regen = 5.0
     mean_age = 1000.0
+    image = ":resources:images/tiles/bush.png"
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(
-            *args, ":resources:images/tiles/bush.png", scale=OBJ_SIZE / 128, **kwargs
-        )
+    # At full health it has nothing to regen
+    def is_idle(self) -> bool:
+        return self.health >= 100
 
 
 class AgentWithHunger(AgentWithAge):
     hunger_damage: float = 10.0
+    __slots__ = ("hunger",)
     hunger: float
     hunger_buildup: float = 4.0
     satisfied_health_regen: float = 3.0
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def reset(self, *args, **kwargs) -> None:
+        super().reset(*args, **kwargs)
         self.hunger = R.uniform(0, 10)
 
     def update(self):
-        self.hunger = min(100, self.hunger + self.hunger_buildup * DT)
-        if self.hunger >= 100:
-            self.health -= self.hunger_damage * DT
-        elif not self.is_hungry:
-            self.add_health(self.satisfied_health_regen * DT)
+        # Otherwise Map.kernel already did this
+        if not self.batched:
+            self.hunger = min(100, self.hunger + self.hunger_buildup * DT)
+            if self.hunger >= 100:
+                self.health -= self.hunger_damage * DT
+            elif not self.is_hungry:
+                self.add_health(self.satisfied_health_regen * DT)
         super().update()
 
-    def draw(self, **kwargs):
-        super().draw(**kwargs)
-        if not SHOW_BARS:
-            return
-        hunger_bar_width = self.hitbox_width * (self.hunger / 100)
-        hunger_bar_height = 5
-        hunger_bar_x = self.left + hunger_bar_width / 2
-        hunger_bar_y = self.top + hunger_bar_height / 2 + 5
-        arcade.draw_rectangle_filled(
-            hunger_bar_x,
-            hunger_bar_y,
-            hunger_bar_width,
-            hunger_bar_height,
+    def add_bars(self, bars: BarBatch) -> None:
+        super().add_bars(bars)
+        bars.add(
+            self.left,
+            self.top + BAR_HEIGHT,
+            self.hitbox_width * (self.hunger / 100),
             arcade.color.RED,
         )
 
@@ -242,32 +368,62 @@ class AgentWithHunger(AgentWithAge):
 
 
 class AgentWithProcreation(AgentWithHunger):
-    time_to_procreate: float
     procreate_mean: float = 60.0
+    __slots__ = ("procreation_timer", "procreation_due")
+    # Runs while the agent can procreate, see procreation_rate
+    procreation_timer: Timer
+    # The timer went off, it procreates as soon as it can
+    procreation_due: bool
+
+    def reset(self, *args, **kwargs) -> None:
+        super().reset(*args, **kwargs)
+        # The timer of its previous life, if it was reused, must not fire
+        previous: Optional[Timer] = getattr(self, "procreation_timer", None)
+        if previous is not None:
+            self.map.timers.cancel(previous)
+        self.procreation_due = False
+        self.procreation_timer = self.map.timers.schedule(
+            self.procreation_delay(), self.procreate, self.procreation_rate()
+        )
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.reset_procreation()
+    def procreation_delay(self) -> float:
+        return max(10, R.gauss(self.procreate_mean, self.procreate_mean / 2))
 
     def reset_procreation(self) -> None:
-        self.time_to_procreate = max(
-            10, R.gauss(self.procreate_mean, self.procreate_mean / 2)
-        )
+        self.map.timers.restart(self.procreation_timer, self.procreation_delay())
+
+    @property
+    def time_to_procreate(self) -> float:
+        return self.map.timers.remaining(self.procreation_timer)
 
     def can_procreate(self) -> bool:
         return not self.is_hungry
 
+    # How fast the time to procreate goes down
+    def procreation_rate(self) -> float:
+        return 1.0 if self.can_procreate() else 0.0
+
+    def procreate(self) -> None:
+        self.procreation_due = True
+
+    def kill(self) -> None:
+        self.map.timers.cancel(self.procreation_timer)
+        super().kill()
+
     def update(self):
         super().update()
-        if self.can_procreate():
-            self.time_to_procreate -= DT
-            if self.time_to_procreate <= 0:
-                # print("%s procreated" % self)
-                self.map.create_agent(
-                    max(0, self.left - self.width), self.top, self.__class__, health=20
-                )
-                self.hunger += 30
-                self.reset_procreation()
+        # Died in this update, kill cancelled its timer and it must stay so
+        if self.is_dead:
+            return
+        if self.procreation_due and self.can_procreate():
+            # print("%s procreated" % self)
+            self.procreation_due = False
+            self.map.create_agent(
+                max(0, self.left - self.width), self.top, self.__class__, health=20
+            )
+            self.hunger += 30
+            self.reset_procreation()
+        self.map.timers.set_rate(self.procreation_timer, self.procreation_rate())
 
 
 class Herbivore(AgentWithProcreation):
@@ -275,41 +431,45 @@ class Herbivore(AgentWithProcreation):
     health_regen = 1.0
     procreate_mean: float = 60.0
     mean_attack_damage: float = 10.0
-
-    class HState:
-        pass
-
-    @dataclass
-    class Idle(HState):
-        time_to_move: float
-
-        @staticmethod
-        def random(max: float):
-            return Herbivore.Idle(R.uniform(max / 4, max))
-
-    @dataclass
-    class ChasingFood(HState):
-        target: Grass
-
-    @dataclass
-    class Eating(HState):
-        target: Grass
-
-    @dataclass
-    class AttackCooldown(HState):
-        time_to_wait: float
-        target: "Carnivore"
-
-    state: HState
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(
-            *args,
-            ":resources:images/enemies/wormPink.png",
-            scale=OBJ_SIZE / 128,
-            **kwargs,
-        )
-        self.state = Herbivore.Idle.random(3)
+    image = ":resources:images/enemies/wormPink.png"
+
+    # What state_time and target mean depends on the state
+    class State(Enum):
+        # Picks a new direction at state_time
+        Idle = 0
+        # Goes to the target grass
+        ChasingFood = 1
+        Eating = 2
+        # Attacked the target carnivore, waits until state_time
+        AttackCooldown = 3
+
+    __slots__ = (
+        "state",
+        "state_time",
+        "target",
+        "idle_speed",
+        "chase_speed",
+        "eat_speed",
+        "attack_damage",
+    )
+    state: State
+    state_time: float
+    target: Optional[AgentWithHealth]
+
+    def set_state(
+        self, state: State, time: float = 0.0, target: Optional[AgentWithHealth] = None
+    ) -> None:
+        self.state = state
+        self.state_time = time
+        self.target = target
+
+    # Idle until a random time, at most max seconds from now
+    def idle(self, max: float) -> None:
+        self.set_state(Herbivore.State.Idle, self.map.time + R.uniform(max / 4, max))
+
+    def reset(self, *args, **kwargs) -> None:
+        super().reset(*args, **kwargs)
+        self.idle(3)
         self.idle_speed: float = R.uniform(0.3, 1.2)
         self.chase_speed: float = R.uniform(0.3, 2.0)
         self.eat_speed: float = R.uniform(15, 20)
@@ -329,36 +489,37 @@ class Herbivore(AgentWithProcreation):
         if grass is None:
             grass = self.find_close(Grass)
         if grass is not None:
-            self.state = Herbivore.ChasingFood(grass)
+            self.set_state(Herbivore.State.ChasingFood, target=grass)
         return grass is not None
 
     # This might also attack carnivores attacking other prey, which is kinda nice for group behaviour.
     def try_attack_carnivore(self) -> bool:
+        # Sprites are OBJ_SIZE wide, so anything colliding is also within range
         carnivore = self.find_close(
             Carnivore,
-            lambda c: isinstance(c.state, Carnivore.AttackCooldown)
-            and (
-                arcade.get_distance_between_sprites(self, c) < 130
-                or self.collides_with_sprite(c)
-            ),
+            lambda c: c.state is Carnivore.State.AttackCooldown,
+            max_dist=130,
         )
         if carnivore is not None:
             carnivore.remove_health(self.attack_damage)
-            self.state = Herbivore.AttackCooldown(1.2, carnivore)
+            self.map.events.emit(Attack, self.type, Carnivore, self.attack_damage)
+            self.set_state(
+                Herbivore.State.AttackCooldown, self.map.time + 1.2, carnivore
+            )
         return carnivore is not None
 
     # Attracted to other herbivores but repel when too close
     def calculate_external_force(self) -> Vector:
-        if not isinstance(self.state, Herbivore.Idle):
+        if self.state is not Herbivore.State.Idle:
             return (0, 0)
         self.max_speed = self.idle_speed
         external_force: List[float] = [0.0, 0.0]
-        for c in self.map.agents(Herbivore):
+        for c in self.map.agents_near(Herbivore, self, INTERACTION_RADIUS):
             if c is self:
                 continue
             vec = [c.center_x - self.center_x, c.center_y - self.center_y]
             norm2 = len2(vec)
-            max_dist = 300
+            max_dist = INTERACTION_RADIUS
             if norm2 > max_dist * max_dist:
                 continue
             norm = norm2**0.5
@@ -393,41 +554,43 @@ class Herbivore(AgentWithProcreation):
         # )
         return external_force
 
+    # Herbivores get older faster, procreation-wise
+    def procreation_rate(self) -> float:
+        return super().procreation_rate() + 1.0
+
     def update(self):
         super().update()
-        self.time_to_procreate -= DT
         match self.state:
-            case Herbivore.Idle(_) as state:
-                state.time_to_move -= DT
+            case Herbivore.State.Idle:
                 if self.hunger >= 60 and self.chase_food():
                     return
                 if self.try_attack_carnivore():
                     return
                 if (
-                    self.hunger >= 40 and state.time_to_move <= 0
+                    self.hunger >= 40 and self.map.time >= self.state_time
                 ) and self.chase_food():
                     return
-                if state.time_to_move <= 0:
+                if self.map.time >= self.state_time:
                     dir = arcade.rotate_point(1, 0, 0, 0, R.uniform(0, 360))
                     self.velocity = [dir[0] * self.idle_speed, dir[1] * self.idle_speed]
                     self.base_force = [
                         dir[0] * self.idle_speed / 2,
                         dir[1] * self.idle_speed / 2,
                     ]
-                    self.state = Herbivore.Idle.random(8)
-            case Herbivore.AttackCooldown(_, _) as state:
-                state.time_to_wait -= DT
-                if state.time_to_wait <= 0:
+                    self.idle(8)
+            case Herbivore.State.AttackCooldown:
+                if self.map.time >= self.state_time:
                     if self.try_attack_carnivore():
                         return
                     else:
-                        self.state = Herbivore.Idle(0)
-            case Herbivore.ChasingFood(target):
+                        self.set_state(Herbivore.State.Idle, self.map.time)
+            case Herbivore.State.ChasingFood:
+                target = cast(Grass, self.target)
                 if target.is_dead:
-                    self.state = Herbivore.Idle.random(1)
+                    self.idle(1)
                 elif self.collides_with_sprite(target):
                     self.velocity = [0, 0]
-                    self.state = Herbivore.Eating(target)
+                    self.set_state(Herbivore.State.Eating, target=target)
                 else:
                     self.max_speed = self.chase_speed
                     self.angle = 0
@@ -435,15 +598,17 @@ class Herbivore(AgentWithProcreation):
                     self.face_point(target.position)
                     self.angle += 90
                     self.forward(self.chase_speed)
-            case Herbivore.Eating(target):
+            case Herbivore.State.Eating:
+                target = cast(Grass, self.target)
                 if target.is_dead:
-                    self.state = Herbivore.Idle.random(1)
+                    self.idle(1)
                 else:
                     eaten = target.remove_health(self.eat_speed * DT)
                     self.remove_hunger(eaten * self.health_to_hunger)
+                    self.map.events.emit(Ate, self.type, target.type, eaten)
                     # Stop eating if we're going to kill the plant
                     if self.hunger <= 0 or (self.hunger < 40 and target.health <= 10):
-                        self.state = Herbivore.Idle.random(0.5)
+                        self.idle(0.5)
             case _:
                 raise ValueError("Unknown state")
 
@@ -456,41 +621,46 @@ class Carnivore(AgentWithProcreation):
     hunger_buildup = 5.0
     mean_attack_damage: float = 45.0
     mean_chase_speed: float = 1.5
-
-    class CState:
-        pass
-
-    @dataclass
-    class Idle(CState):
-        time_to_move: float
-
-        @staticmethod
-        def random(max: float):
-            return Carnivore.Idle(R.uniform(max / 4, max))
-
-    @dataclass
-    class ChasingPrey(CState):
-        target: Herbivore | Carcass
-
-    @dataclass
-    class AttackCooldown(CState):
-        time_to_wait: float
-        target: Herbivore
-
-    @dataclass
-    class Eating(CState):
-        target: Carcass
-
-    state: CState
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(
-            *args,
-            ":resources:images/enemies/slimeBlue.png",
-            scale=OBJ_SIZE / 128,
-            **kwargs,
-        )
-        self.state = Carnivore.Idle(0)
+    image = ":resources:images/enemies/slimeBlue.png"
+
+    # What state_time and target mean depends on the state
+    class State(Enum):
+        # Picks a new direction at state_time
+        Idle = 0
+        # Goes to the target herbivore or carcass
+        ChasingPrey = 1
+        # Attacked the target herbivore, chases it again at state_time
+        AttackCooldown = 2
+        # Eats the target carcass
+        Eating = 3
+
+    __slots__ = (
+        "state",
+        "state_time",
+        "target",
+        "idle_speed",
+        "chase_speed",
+        "eat_speed",
+        "attack_damage",
+    )
+    state: State
+    state_time: float
+    target: Optional[AgentWithHealth]
+
+    def set_state(
+        self, state: State, time: float = 0.0, target: Optional[AgentWithHealth] = None
+    ) -> None:
+        self.state = state
+        self.state_time = time
+        self.target = target
+
+    # Idle until a random time, at most max seconds from now
+    def idle(self, max: float) -> None:
+        self.set_state(Carnivore.State.Idle, self.map.time + R.uniform(max / 4, max))
+
+    def reset(self, *args, **kwargs) -> None:
+        super().reset(*args, **kwargs)
+        self.set_state(Carnivore.State.Idle, self.map.time)
         self.idle_speed: float = R.uniform(0.3, 1.2)
         self.chase_speed: float = simple_gauss(self.mean_chase_speed)
         self.eat_speed: float = R.uniform(15, 20)
@@ -505,16 +675,16 @@ class Carnivore(AgentWithProcreation):
 
     # Repel close carnivores
     def calculate_external_force(self) -> Vector:
-        if not isinstance(self.state, Carnivore.Idle):
+        if self.state is not Carnivore.State.Idle:
             return (0, 0)
         self.max_speed = self.idle_speed
         external_force = [0.0, 0.0]
-        for c in self.map.agents(Carnivore):
+        for c in self.map.agents_near(Carnivore, self, INTERACTION_RADIUS):
             if c is self:
                 continue
             vec = [self.center_x - c.center_x, self.center_y - c.center_y]
             norm2 = len2(vec)
-            max_dist = 300
+            max_dist = INTERACTION_RADIUS
             if norm2 <= max_dist * max_dist:
                 norm = norm2**0.5
                 mult = (((max_dist - norm) / max_dist) ** 1.2) * self.idle_speed * 5
@@ -528,48 +698,51 @@ class Carnivore(AgentWithProcreation):
         super().update()
         while True:
             match self.state:
-                case Carnivore.Idle(_) as state:
-                    state.time_to_move -= DT
+                case Carnivore.State.Idle:
                     if (
                         self.hunger >= 50
-                        or (self.hunger >= 30 and state.time_to_move <= 0)
+                        or (self.hunger >= 30 and self.map.time >= self.state_time)
                         or self.hunger - self.health >= 20
                     ):
-                        carcass = self.find_close(
-                            Carcass,
-                            lambda c: arcade.get_distance_between_sprites(self, c)
-                            < 300,
-                        )
+                        carcass = self.find_close(Carcass, max_dist=INTERACTION_RADIUS)
                         if carcass is not None:
-                            self.state = Carnivore.ChasingPrey(carcass)
+                            self.set_state(Carnivore.State.ChasingPrey, target=carcass)
                             return
                         herbivore = self.find_close(
-                            Herbivore,
-                            lambda h: arcade.get_distance_between_sprites(self, h)
-                            < 300,
+                            Herbivore, max_dist=INTERACTION_RADIUS
                         )
                         if herbivore is None:
                             self.find_close(Herbivore)  # Any will do
                         if herbivore is not None:
-                            self.state = Carnivore.ChasingPrey(herbivore)
+                            self.set_state(
+                                Carnivore.State.ChasingPrey, target=herbivore
+                            )
                             return
-                    if state.time_to_move <= 0:
+                    if self.map.time >= self.state_time:
                         dir = arcade.rotate_point(1, 0, 0, 0, R.uniform(0, 360))
                         spd = self.idle_speed
                         self.base_force = [dir[0] * spd / 2, dir[1] * spd / 2]
                         self.velocity = [dir[0] * spd, dir[1] * spd]
-                        self.state = Carnivore.Idle.random(8)
-                case Carnivore.ChasingPrey(target):
+                        self.idle(8)
+                case Carnivore.State.ChasingPrey:
+                    target = cast(AgentWithHealth, self.target)
                     if target.is_dead:
-                        self.state = Carnivore.Idle(0)
+                        self.set_state(Carnivore.State.Idle, self.map.time)
                         continue
                     elif self.collides_with_sprite(target):
                         self.velocity = [0, 0]
                         if isinstance(target, Carcass):
-                            self.state = Carnivore.Eating(target)
+                            self.set_state(Carnivore.State.Eating, target=target)
                         elif isinstance(target, Herbivore):
                             target.remove_health(self.attack_damage)
-                            self.state = Carnivore.AttackCooldown(1, target)
+                            self.map.events.emit(
+                                Attack, self.type, target.type, self.attack_damage
+                            )
+                            self.set_state(
+                                Carnivore.State.AttackCooldown,
+                                self.map.time + 1,
+                                target,
+                            )
                         else:
                             raise ValueError("Unknown target type")
                     else:
@@ -580,19 +753,20 @@ class Carnivore(AgentWithProcreation):
                         self.face_point(target.position)
                         self.angle += 90
                         self.forward(self.chase_speed)
-                case Carnivore.AttackCooldown(_, target) as state:
-                    state.time_to_wait -= DT
-                    if state.time_to_wait <= 0:
-                        self.state = Carnivore.ChasingPrey(target)
+                case Carnivore.State.AttackCooldown:
+                    if self.map.time >= self.state_time:
+                        self.set_state(Carnivore.State.ChasingPrey, target=self.target)
                         continue
-                case Carnivore.Eating(target):
+                case Carnivore.State.Eating:
+                    target = cast(Carcass, self.target)
                     if target.is_dead:
-                        self.state = Carnivore.Idle.random(1)
+                        self.idle(1)
                     else:
                         eaten = target.remove_health(self.eat_speed * DT)
                         self.remove_hunger(eaten * self.health_to_hunger)
+                        self.map.events.emit(Ate, self.type, target.type, eaten)
                         if self.hunger <= 0:
-                            self.state = Carnivore.Idle.random(1)
+                            self.idle(1)
                 case _:
                     raise ValueError("Unknown state")
             # The default is to end unless we use continue
@@ -603,22 +777,61 @@ ALL_AGENTS = [Grass, Herbivore, Carcass, Carnivore]
 
 
 class Map(SpriteSolidColor):
-    scene = arcade.Scene()
-
-    def __init__(self, size: int) -> None:
-        super().__init__(size, size, (0, 0, 0))
+    scene: arcade.Scene
+    bars: BarBatch
+    grids: Dict[Type[Agent], SpatialGrid[Agent]]
+    # Static agents that are updated every tick, a dict to keep them in order
+    awake: Dict[Type[Agent], Dict[Agent, None]]
+    # Shared with the Simulation, which flushes it after every tick
+    events: EventBus
+    # Dead agents to reuse, with the map time each one can be reused at
+    pools: Dict[Type[Agent], Deque[Tuple[float, Agent]]]
+    # Deadlines of the agents, its time is the map's time
+    timers: TimerQueue
+    # If set, runs at the start of each tick, before the agents update
+    kernel: Optional[Callable[["Map"], None]] = None
+
+    def __init__(self, size: int, max_per_type: int = MAX_PER_TYPE) -> None:
+        # A pixel stretched over the whole map, a texture of its size would
+        # take gigabytes on large worlds
+        super().__init__(1, 1, (0, 0, 0))
+        self.width = size
+        self.height = size
+        self.max_per_type = max_per_type
         self.center_x = SCREEN_WIDTH / 2
         self.center_y = SCREEN_HEIGHT / 2
+        self.scene = arcade.Scene()
+        self.bars = BarBatch()
+        self.events = EventBus()
+        self.timers = TimerQueue()
+        self.pools = {agent: deque() for agent in ALL_AGENTS}
+        preload(agent.image for agent in ALL_AGENTS)
+        self.grids = {}
+        self.awake = {agent: {} for agent in ALL_AGENTS if agent.static}
         for agent in ALL_AGENTS:
-            self.scene.add_sprite_list(agent.__name__, True)
+            # A spatial hash is updated on every move, so only the static
+            # agents have one
+            self.scene.add_sprite_list(agent.__name__, agent.static)
+            self.grids[agent] = SpatialGrid(INTERACTION_RADIUS)
 
     def gen_random_agents(self, total: int, distribution: List[int]) -> None:
-        for _ in range(total):
-            left = R.uniform(self.left, self.right - OBJ_SIZE)
-            top = R.uniform(self.bottom + OBJ_SIZE, self.top)
-            self.create_agent(
-                left, top, R.choices([Grass, Herbivore, Carnivore], distribution)[0]
+        self.create_agents(*self.random_agents(total, distribution))
+
+    # Where gen_random_agents puts each agent, and of which type
+    def random_agents(
+        self, total: int, distribution: List[int]
+    ) -> Tuple[List[Tuple[float, float]], List[Type[Agent]]]:
+        positions = [
+            (
+                R.uniform(self.left, self.right - OBJ_SIZE),
+                R.uniform(self.bottom + OBJ_SIZE, self.top),
             )
+            for _ in range(total)
+        ]
+        types: List[Type[Agent]] = R.choices(
+            [Grass, Herbivore, Carnivore], distribution, k=total
+        )
+        return (positions, types)
 
     def sprite_list(self, agent: Type[Agent]) -> arcade.SpriteList:
         return self.scene.get_sprite_list(agent.__name__)
@@ -626,43 +839,189 @@ class Map(SpriteSolidColor):
     def agents(self, agent: Type[Agent]) -> Sequence[Agent]:
         return cast(List[Agent], self.sprite_list(agent).sprite_list)
 
+    def agents_near(self, agent: Type[T], center: Sprite, radius: float) -> Iterable[T]:
+        return cast(
+            Iterable[T],
+            self.grids[agent].query(center.center_x, center.center_y, radius),
+        )
+
+    # Agents of a type within max_dist of center, and their squared distances
+    # to it. Not cached, as no agent looks for the same type twice in a tick.
+    def neighbours(
+        self, center: Agent, agent: Type[T], max_dist: float
+    ) -> Tuple[List[T], List[float]]:
+        found = self.grids[agent].query_distances(
+            center.center_x, center.center_y, max_dist
+        )
+        return cast(Tuple[List[T], List[float]], found)
+
+    @property
+    def time(self) -> float:
+        return self.timers.time
+
+    # Static agents sleep once they are idle, until this is called because
+    # something changed them. Agents no longer in the map stay out.
+    def wake(self, agent: Agent) -> None:
+        if agent.static and len(agent.sprite_lists) > 0:
+            self.awake[agent.type][agent] = None
+
     def update(self):
-        for list in self.scene.sprite_lists:
-            for obj in list.sprite_list:
-                obj = cast(Agent, obj)
+        self.timers.advance(DT)
+        if self.kernel is not None:
+            start = PROFILER.start()
+            self.kernel(self)
+            PROFILER.stop("kernel", "all", start)
+        (left, right, bottom, top) = (self.left, self.right, self.bottom, self.top)
+        for agent in ALL_AGENTS:
+            if agent.static:
+                self.update_static(agent)
+                continue
+            grid = self.grids[agent]
+            for obj in self.agents(agent):
+                start = PROFILER.start()
                 obj.update()
-                if obj.left < self.left:
-                    obj.change_x = abs(obj.change_x)
-                    obj.base_force = [abs(obj.base_force[0]), obj.base_force[1]]
-                elif obj.right > self.right:
-                    obj.change_x = -abs(obj.change_x)
-                    obj.base_force = [-abs(obj.base_force[0]), obj.base_force[1]]
-                elif obj.top > self.top:
-                    obj.change_y = -abs(obj.change_y)
-                    obj.base_force = [obj.base_force[0], -abs(obj.base_force[1])]
-                elif obj.bottom < self.bottom:
-                    obj.change_y = abs(obj.change_y)
-                    obj.base_force = [obj.base_force[0], abs(obj.base_force[1])]
+                bounds_start = PROFILER.start()
+                PROFILER.stop("update", obj.type, start)
+                grid.move(obj)
+                # No hit box reaches OBJ_SIZE away from its center, so only the
+                # agents near an edge need their sides computed
+                (x, y) = obj.position
+                if not (
+                    left + OBJ_SIZE < x < right - OBJ_SIZE
+                    and bottom + OBJ_SIZE < y < top - OBJ_SIZE
+                ):
+                    self.bounce(obj)
+                PROFILER.stop("bounds", obj.type, bounds_start)
+
+    # Turns an agent that went past an edge back inside
+    def bounce(self, obj: Agent) -> None:
+        if obj.left < self.left:
+            obj.change_x = abs(obj.change_x)
+            obj.base_force = [abs(obj.base_force[0]), obj.base_force[1]]
+        elif obj.right > self.right:
+            obj.change_x = -abs(obj.change_x)
+            obj.base_force = [-abs(obj.base_force[0]), obj.base_force[1]]
+        elif obj.top > self.top:
+            obj.change_y = -abs(obj.change_y)
+            obj.base_force = [obj.base_force[0], -abs(obj.base_force[1])]
+        elif obj.bottom < self.bottom:
+            obj.change_y = abs(obj.change_y)
+            obj.base_force = [obj.base_force[0], abs(obj.base_force[1])]
+
+    # Only the awake ones, which fall asleep once idle. A copy is iterated, as
+    # dying removes them.
+    def update_static(self, agent: Type[Agent]) -> None:
+        awake = self.awake[agent]
+        for obj in list(awake):
+            start = PROFILER.start()
+            obj.update()
+            if obj.is_idle():
+                awake.pop(obj, None)
+            PROFILER.stop("update", agent, start)
 
     def draw(self, **kwargs) -> None:
         super().draw(**kwargs)
+        self.scene.draw()
         if SHOW_BARS:
-            for obj in self.scene.sprite_lists:
-                for obj in obj.sprite_list:
-                    obj.draw()
-        else:
-            # This should be faster if we're drawing raw sprites
-            self.scene.draw()
+            self.bars.begin()
+            for list in self.scene.sprite_lists:
+                for obj in list.sprite_list:
+                    cast(AgentWithHealth, obj).add_bars(self.bars)
+            self.bars.end()
+            self.bars.draw()
+
+    # A dead agent from the pool if one can be reused, otherwise a new one.
+    # Either way it is not in the map yet.
+    def new_agent(
+        self, x: float, y: float, agent: Type[Agent], kwargs: Dict[str, Any]
+    ) -> Agent:
+        pool = self.pools[agent]
+        if len(pool) > 0 and pool[0][0] <= self.time:
+            (_, obj) = pool.popleft()
+            obj.reset(x, y, **kwargs)
+            return obj
+        return agent(self, x, y, type=agent, **kwargs)
+
+    def add_agent(self, obj: Agent) -> None:
+        self.sprite_list(obj.type).append(obj)
+        self.grids[obj.type].insert(obj)
+        self.wake(obj)
+        self.events.emit(Birth, obj.type)
+
+    # Whether one more of a type fits under max_per_type, with `pending` more
+    # of it about to be added
+    def room_for(self, agent: Type[Agent], pending: int = 0) -> bool:
+        return len(self.agents(agent)) + pending < self.max_per_type
 
     def create_agent(self, x: float, y: float, agent: Type[Agent], **kwargs) -> bool:
-        if len(self.agents(agent)) > 1000:
-            print("TOO MANY %s AGENTS" % agent.__name__)
+        if not self.room_for(agent):
+            self.events.emit(Cap, agent)
             return False
-        self.scene.add_sprite(agent.__name__, agent(self, x, y, type=agent, **kwargs))
+        start = PROFILER.start()
+        self.add_agent(self.new_agent(x, y, agent, kwargs))
+        PROFILER.stop("create", agent, start)
         return True
 
+    # Creates agent types[i] at positions[i], with the keyword arguments
+    # attributes[i] if given, capped as create_agent would one by one. All of
+    # them are built first and then added to the map type by type. Returns how
+    # many were created.
+    def create_agents(
+        self,
+        positions: Sequence[Tuple[float, float]],
+        types: Sequence[Type[Agent]],
+        attributes: Optional[Sequence[Dict[str, Any]]] = None,
+    ) -> int:
+        start = PROFILER.start()
+        created: Dict[Type[Agent], List[Agent]] = {agent: [] for agent in ALL_AGENTS}
+        for i, ((x, y), agent) in enumerate(zip(positions, types)):
+            batch = created[agent]
+            if not self.room_for(agent, len(batch)):
+                self.events.emit(Cap, agent)
+                continue
+            kwargs = attributes[i] if attributes is not None else {}
+            batch.append(self.new_agent(x, y, agent, kwargs))
+        for batch in created.values():
+            for obj in batch:
+                self.add_agent(obj)
+        PROFILER.stop("create", "all", start)
+        return sum(len(batch) for batch in created.values())
+
+    # No more than max_per_type of a type are alive at once, so that is also
+    # the most a pool needs
+    def release(self, agent: Agent) -> None:
+        pool = self.pools[agent.type]
+        if len(pool) < self.max_per_type:
+            pool.append((self.time + POOL_QUARANTINE, agent))
+
+    # The checkpoint module depends on this one, hence the late imports
+    def save_checkpoint(self, path: str) -> None:
+        import checkpoint
+
+        with open(path, "wb") as f:
+            checkpoint.save(self, f)
+
+    @staticmethod
+    def load_checkpoint(path: str) -> "Map":
+        import checkpoint
+
+        with open(path, "rb") as f:
+            return checkpoint.load(f)
+
+    # Movers are looked up in their grid, which Map.update already keeps, as
+    # their sprite lists have no spatial hash. No sprite is larger than
+    # OBJ_SIZE, so the ones touching the point are at most that far away.
     def find_at_point(self, x: float, y: float) -> Sequence[Agent]:
-        found = []
+        found: List[Agent] = []
         for agent in ALL_AGENTS:
-            found.extend(arcade.get_sprites_at_point((x, y), self.sprite_list(agent)))
+            if agent.static:
+                found.extend(
+                    arcade.get_sprites_at_point((x, y), self.sprite_list(agent))
+                )
+            else:
+                found.extend(
+                    obj
+                    for obj in self.grids[agent].query(x, y, OBJ_SIZE)
+                    if obj.collides_with_point((x, y))
+                )
         return found
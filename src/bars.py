@@ -0,0 +1,37 @@
+from arcade import SpriteList, SpriteSolidColor, color
+from arcade.arcade_types import Color
+from constants import OBJ_SIZE
+
+BAR_HEIGHT = 5
+
+
+# Health and hunger bars of a whole frame, kept as tinted white rectangles in
+# one SpriteList. The rectangles are reused between frames, so drawing all the
+# bars is a buffer update and a single draw call.
+class BarBatch:
+    sprites: SpriteList
+    count: int = 0
+
+    def __init__(self) -> None:
+        self.sprites = SpriteList()
+
+    def begin(self) -> None:
+        self.count = 0
+
+    def add(self, left: float, bottom: float, width: float, tint: Color) -> None:
+        if self.count == len(self.sprites):
+            self.sprites.append(SpriteSolidColor(OBJ_SIZE, BAR_HEIGHT, color.WHITE))
+        bar = self.sprites[self.count]
+        bar.width = max(width, 0)
+        bar.center_x = left + bar.width / 2
+        bar.center_y = bottom + BAR_HEIGHT / 2
+        bar.color = tint
+        self.count += 1
+
+    # Drops the rectangles left over from a frame with more bars
+    def end(self) -> None:
+        while len(self.sprites) > self.count:
+            self.sprites.pop()
+
+    def draw(self) -> None:
+        self.sprites.draw()
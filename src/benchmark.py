@@ -0,0 +1,171 @@
+import agents
+from agents import ALL_AGENTS, Map
+from constants import MAX_PER_TYPE
+from kernels import update_movers
+from simulation import map_size
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+# Measures how Map.update scales with population size and mix. Every scenario
+# runs in a fresh process so its peak RSS is its own.
+
+MIXES: Dict[str, List[int]] = {
+    "grass-heavy": [8, 1, 1],
+    "herbivore-heavy": [1, 8, 1],
+    "carnivore-heavy": [1, 1, 8],
+    "balanced": [1, 1, 1],
+}
+SIZES = [50, 200, 1000, 5000]
+# Higher is better for the first, lower for the others
+COMPARED = [("ticks_per_sec", 1), ("p50_ms", -1), ("p99_ms", -1)]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    i = min(len(sorted_values) - 1, int(pct / 100 * len(sorted_values)))
+    return sorted_values[i]
+
+
+def run_scenario(
+    mix: str, total: int, warmup: int, ticks: int, seed: int, vectorized: bool
+) -> Dict[str, object]:
+    agents.R.seed(seed)
+    map = Map(map_size(total), max_per_type=max(total, MAX_PER_TYPE))
+    if vectorized:
+        map.kernel = update_movers
+    start = time.perf_counter()
+    map.gen_random_agents(total, MIXES[mix])
+    setup = time.perf_counter() - start
+    for _ in range(warmup):
+        map.update()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(ticks):
+        tick_start = time.perf_counter()
+        map.update()
+        latencies.append(time.perf_counter() - tick_start)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "name": f"{mix}-{total}",
+        "mix": mix,
+        "agents": total,
+        "map_size": map_size(total),
+        "setup_s": round(setup, 4),
+        "ticks_per_sec": round(ticks / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit / 2**20,
+            1,
+        ),
+        "final_counts": {a.__name__: len(map.agents(a)) for a in ALL_AGENTS},
+    }
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    old = {r["name"]: r for r in baseline}
+    regressions = []
+    for r in results:
+        if r["name"] not in old:
+            continue
+        for metric, direction in COMPARED:
+            before, after = (old[r["name"]][metric], r[metric])
+            if before == 0:
+                continue
+            change = (after - before) / before * direction
+            if change < -tolerance:
+                regressions.append(
+                    f"{r['name']}: {metric} went from {before} to {after}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Map.update")
+    parser.add_argument("--mixes", nargs="+", choices=list(MIXES), default=list(MIXES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--warmup", type=int, default=60)
+    parser.add_argument("--ticks", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=2014)
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Runs per scenario, the fastest one is reported",
+    )
+    parser.add_argument("--vectorized", action="store_true")
+    parser.add_argument("--out", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.15,
+        help="Relative slowdown allowed before failing against the baseline",
+    )
+    args = parser.parse_args()
+
+    scenarios: List[Tuple[str, int]] = [
+        (mix, total) for total in args.sizes for mix in args.mixes
+    ]
+    results = []
+    print(f"{'scenario':<22}{'ticks/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'RSS MB':>10}")
+    for mix, total in scenarios:
+        runs = []
+        for _ in range(args.repeats):
+            with ProcessPoolExecutor(
+                1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                runs.append(
+                    executor.submit(
+                        run_scenario,
+                        mix,
+                        total,
+                        args.warmup,
+                        args.ticks,
+                        args.seed,
+                        args.vectorized,
+                    ).result()
+                )
+        result = max(runs, key=lambda r: r["ticks_per_sec"])
+        results.append(result)
+        print(
+            f"{result['name']:<22}{result['ticks_per_sec']:>10}"
+            f"{result['p50_ms']:>10}{result['p99_ms']:>10}{result['peak_rss_mb']:>10}"
+        )
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "vectorized": args.vectorized,
+        "warmup": args.warmup,
+        "ticks": args.ticks,
+        "seed": args.seed,
+        "repeats": args.repeats,
+        "results": results,
+    }
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if len(regressions) > 0:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import agents
+from agents import (
+    ALL_AGENTS,
+    Agent,
+    AgentWithAge,
+    AgentWithHealth,
+    AgentWithHunger,
+    AgentWithProcreation,
+    Carcass,
+    Carnivore,
+    Herbivore,
+    Map,
+)
+from timers import INF, Timer
+from simulation import PARAMETERS
+from enum import Enum
+from typing import BinaryIO, Dict, List, Optional, Tuple
+import heapq
+import struct
+
+# Binary checkpoint of a Map: the slider parameters, the state of agents.R, the
+# map's time and one fixed-size record per agent, timers included. Restoring
+# it and running the same ticks is bit-for-bit identical to continuing the
+# original run.
+
+MAGIC = b"EQCK"
+VERSION = 2
+
+# magic, version, map size, parameter count, map time, next timer seq
+HEADER = struct.Struct("<4sHdIdq")
+PARAM = struct.Struct("<H")
+RNG = struct.Struct("<625I?d")
+COUNTS = struct.Struct("<II")
+# type, original, state, flags, target, grid rank, age timer seq, procreation
+# timer seq (-1 when not in the heap), then the floats
+RECORD = struct.Struct("<bbbBiiqq21d")
+
+# Flags. Dead or removed agents that are still the target of a live agent are
+# DETACHED, they are restored but not added back to the map.
+DETACHED = 1
+PROCREATION_DUE = 2
+PROCREATION_ACTIVE = 4
+
+STATES: List[Enum] = [
+    Herbivore.State.Idle,
+    Herbivore.State.ChasingFood,
+    Herbivore.State.Eating,
+    Herbivore.State.AttackCooldown,
+    Carnivore.State.Idle,
+    Carnivore.State.ChasingPrey,
+    Carnivore.State.AttackCooldown,
+    Carnivore.State.Eating,
+]
+
+
+def agent_record(agent: Agent, index: Dict[Agent, int], rank: int, flags: int) -> bytes:
+    state = getattr(agent, "state", None)
+    target = getattr(agent, "target", None)
+    age_timer: Optional[Timer] = getattr(agent, "age_timer", None)
+    procreation: Optional[Timer] = getattr(agent, "procreation_timer", None)
+    if getattr(agent, "procreation_due", False):
+        flags |= PROCREATION_DUE
+    if procreation is not None and procreation.active:
+        flags |= PROCREATION_ACTIVE
+    return RECORD.pack(
+        ALL_AGENTS.index(agent.type),
+        ALL_AGENTS.index(agent.original) if isinstance(agent, Carcass) else -1,
+        STATES.index(state) if state is not None else -1,
+        flags,
+        index.get(target, -1) if target is not None else -1,
+        rank,
+        age_timer.seq if age_timer is not None else -1,
+        procreation.seq if procreation is not None else -1,
+        agent.center_x,
+        agent.center_y,
+        agent.velocity[0],
+        agent.velocity[1],
+        agent.base_force[0],
+        agent.base_force[1],
+        agent.angle,
+        agent.max_speed,
+        getattr(agent, "health", 0.0),
+        getattr(agent, "death_time", 0.0),
+        getattr(agent, "hunger", 0.0),
+        procreation.remaining if procreation is not None else 0.0,
+        procreation.since if procreation is not None else 0.0,
+        procreation.rate if procreation is not None else 0.0,
+        getattr(agent, "idle_speed", 0.0),
+        getattr(agent, "chase_speed", 0.0),
+        getattr(agent, "eat_speed", 0.0),
+        getattr(agent, "attack_damage", 0.0),
+        getattr(agent, "rot_speed", 0.0),
+        getattr(agent, "total_rotted", 0.0),
+        getattr(agent, "state_time", 0.0),
+    )
+
+
+def save(map: Map, out: BinaryIO) -> None:
+    live: List[Agent] = [a for agent in ALL_AGENTS for a in map.agents(agent)]
+    index: Dict[Agent, int] = {a: i for (i, a) in enumerate(live)}
+    detached: List[Agent] = []
+    for a in live:
+        target = getattr(a, "target", None)
+        if target is not None and target not in index:
+            index[target] = len(live) + len(detached)
+            detached.append(target)
+    # Position of each agent inside its grid cell, which decides query order
+    rank: Dict[Agent, int] = {}
+    for grid in map.grids.values():
+        for bucket in grid.cells.values():
+            for i, a in enumerate(bucket):
+                rank[a] = i
+
+    out.write(
+        HEADER.pack(
+            MAGIC,
+            VERSION,
+            map.width,
+            len(PARAMETERS),
+            map.timers.time,
+            map.timers.next_seq,
+        )
+    )
+    for agent_type, field, _, _, _ in PARAMETERS:
+        name = f"{agent_type.__name__}.{field}".encode()
+        out.write(PARAM.pack(len(name)) + name)
+        out.write(struct.pack("<d", getattr(agent_type, field)))
+    _, internal, gauss_next = agents.R.getstate()
+    out.write(
+        RNG.pack(*internal, gauss_next is not None, gauss_next or 0.0)  # type: ignore
+    )
+    out.write(COUNTS.pack(len(live), len(detached)))
+    out.write(b"".join(agent_record(a, index, rank[a], 0) for a in live))
+    out.write(b"".join(agent_record(a, index, -1, DETACHED) for a in detached))
+
+
+def read(inp: BinaryIO, s: struct.Struct) -> Tuple:
+    return s.unpack(inp.read(s.size))
+
+
+def restore_agent(map: Map, values: Tuple) -> Agent:
+    (type_i, original_i) = values[:2]
+    agent_type = ALL_AGENTS[type_i]
+    # Without reset, which would draw random numbers and schedule timers only
+    # for the record to replace them
+    agent = agent_type.blank(map, agent_type)
+    if isinstance(agent, Carcass):
+        agent.original = ALL_AGENTS[original_i]
+    apply_record(agent, values)
+    return agent
+
+
+# Everything in the record but the type, which must match, and the state,
+# whose target might not be restored yet. The timers are not put in the heap.
+def apply_record(agent: Agent, values: Tuple) -> None:
+    map = agent.map
+    _, _, _, flags, _, _, age_seq, procreation_seq = values[:8]
+    x, y, vx, vy, bfx, bfy, angle, max_speed = values[8:16]
+    health, death_time, hunger = values[16:19]
+    (procreation_remaining, procreation_since, procreation_rate) = values[19:22]
+    agent.position = (x, y)
+    agent.velocity = [vx, vy]
+    agent.base_force = [bfx, bfy]
+    agent.angle = angle
+    agent.max_speed = max_speed
+    if isinstance(agent, AgentWithHealth):
+        agent.health = health
+    if isinstance(agent, AgentWithAge):
+        agent.death_time = death_time
+        agent.age_timer = None
+        if age_seq >= 0:
+            agent.age_timer = Timer(
+                agent.die_of_age,
+                death_time - map.time,
+                map.time,
+                1.0,
+                deadline=death_time,
+                seq=age_seq,
+            )
+    if isinstance(agent, AgentWithHunger):
+        agent.hunger = hunger
+    if isinstance(agent, AgentWithProcreation):
+        agent.procreation_due = bool(flags & PROCREATION_DUE)
+        timer = Timer(
+            agent.procreate,
+            procreation_remaining,
+            procreation_since,
+            procreation_rate,
+            active=bool(flags & PROCREATION_ACTIVE),
+            seq=procreation_seq,
+        )
+        if procreation_seq >= 0:
+            timer.deadline = timer.since + timer.remaining / timer.rate
+        agent.procreation_timer = timer
+    if isinstance(agent, (Herbivore, Carnivore)):
+        (
+            agent.idle_speed,
+            agent.chase_speed,
+            agent.eat_speed,
+            agent.attack_damage,
+        ) = values[22:26]
+    if isinstance(agent, Carcass):
+        agent.rot_speed, agent.total_rotted = values[26:28]
+
+
+def timers_of(agent: Agent) -> List[Timer]:
+    timers = [getattr(agent, "age_timer", None)]
+    timers.append(getattr(agent, "procreation_timer", None))
+    return [t for t in timers if t is not None and t.seq >= 0]
+
+
+# The number of live agents in a checkpoint, without loading it
+def live_count(inp: BinaryIO) -> int:
+    magic, version, _, param_count, _, _ = read(inp, HEADER)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a checkpoint file or unsupported version")
+    for _ in range(param_count):
+        (length,) = read(inp, PARAM)
+        inp.seek(length + 8, 1)
+    inp.seek(RNG.size, 1)
+    count, _ = read(inp, COUNTS)
+    return count
+
+
+def load(inp: BinaryIO) -> Map:
+    magic, version, size, param_count, time, next_seq = read(inp, HEADER)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a checkpoint file or unsupported version")
+    params = {f"{a.__name__}.{field}": (a, field) for (a, field, *_) in PARAMETERS}
+    for _ in range(param_count):
+        (length,) = read(inp, PARAM)
+        name = inp.read(length).decode()
+        (value,) = struct.unpack("<d", inp.read(8))
+        if name in params:
+            setattr(*params[name], value)
+    rng = read(inp, RNG)
+    live_count, detached_count = read(inp, COUNTS)
+    records = [read(inp, RECORD) for _ in range(live_count + detached_count)]
+
+    map = Map(int(size))
+    map.timers.time = time
+    restored = [restore_agent(map, values) for values in records]
+    map.timers.heap = [
+        (t.deadline, t.seq, t) for agent in restored for t in timers_of(agent)
+    ]
+    heapq.heapify(map.timers.heap)
+    map.timers.next_seq = next_seq
+    for agent, values in zip(restored, records):
+        _, _, state_i, _, target_i, _ = values[:6]
+        if state_i < 0:
+            continue
+        target: Optional[Agent] = restored[target_i] if target_i >= 0 else None
+        agent.set_state(STATES[state_i], values[-1], target)  # type: ignore
+    for agent in restored[:live_count]:
+        map.scene.add_sprite(agent.type.__name__, agent)
+        map.wake(agent)
+    by_rank = sorted(range(live_count), key=lambda i: records[i][5])
+    for i in by_rank:
+        map.grids[restored[i].type].insert(restored[i])
+    agents.R.setstate((3, tuple(rng[:625]), rng[626] if rng[625] else None))
+    return map
@@ -2,4 +2,6 @@ SCREEN_WIDTH = 1800
 SCREEN_HEIGHT = 900
 OBJ_SIZE = 50
 DT = 1 / 60
-SPEED_MULTIPLIER = 1
+INTERACTION_RADIUS = 300
+MAP_SIZE = 1000
+MAX_PER_TYPE = 1000
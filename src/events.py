@@ -0,0 +1,71 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, List, Type
+
+if TYPE_CHECKING:
+    from agents import Agent, DeathReason
+
+# What happens to the agents, as typed events. Emitting only builds the event
+# if something subscribed to its kind, so with no subscribers it costs a dict
+# lookup. Events are queued and handed to the subscribers in batches when the
+# bus is flushed, once per tick.
+
+
+@dataclass
+class Birth:
+    agent: Type["Agent"]
+
+
+@dataclass
+class Death:
+    agent: Type["Agent"]
+    reason: "DeathReason"
+
+
+@dataclass
+class Ate:
+    agent: Type["Agent"]
+    food: Type["Agent"]
+    amount: float
+
+
+@dataclass
+class Attack:
+    agent: Type["Agent"]
+    target: Type["Agent"]
+    damage: float
+
+
+# A creation was refused because the species reached Map.max_per_type
+@dataclass
+class Cap:
+    agent: Type["Agent"]
+
+
+Handler = Callable[[List], None]
+
+
+class EventBus:
+    subscribers: Dict[type, List[Handler]]
+    pending: Dict[type, List]
+
+    def __init__(self) -> None:
+        self.subscribers = {}
+        self.pending = defaultdict(list)
+
+    # The handler receives a list with every event of that kind since the
+    # previous flush
+    def subscribe(self, kind: type, handler: Handler) -> None:
+        self.subscribers.setdefault(kind, []).append(handler)
+
+    def emit(self, kind: type, *args) -> None:
+        if kind in self.subscribers:
+            self.pending[kind].append(kind(*args))
+
+    def flush(self) -> None:
+        if len(self.pending) == 0:
+            return
+        pending, self.pending = (self.pending, defaultdict(list))
+        for kind, events in pending.items():
+            for handler in self.subscribers[kind]:
+                handler(events)
@@ -1,14 +1,17 @@
-from typing import List, Callable
+from typing import List, Callable, Optional, Tuple
 from constants import DT, SCREEN_HEIGHT, SCREEN_WIDTH
 from common import Updatable
 import arcade, arcade.color
+from arcade import ShapeElementList, Text
 from arcade.arcade_types import Point, Vector
 from enum import Enum
-from dataclasses import dataclass
+import numpy as np
 
 COLLECT_INTERVAL: float = 6.0
 COLORS = [arcade.color.GREEN, arcade.color.PINK, arcade.color.BLUE]
 DX = 10
+# Rows of the aggregates kept for each point
+MIN, MAX, MEAN = 0, 1, 2
 
 
 class GraphMode(Enum):
@@ -16,20 +19,129 @@ class GraphMode(Enum):
     AreaPct = 1
 
 
-@dataclass
-class DataPoint:
-    values: List[float]
-    vertical_mark: bool
+# Ring buffer with the last `capacity` points of one resolution. Point i of
+# level k aggregates the collected points [i * 2**k, (i + 1) * 2**k).
+class HistoryLevel:
+    # (capacity, 3, series): min, max and mean of each series
+    stats: np.ndarray
+    marks: np.ndarray
+    # Points ever appended, the ones before total - capacity were overwritten
+    total: int = 0
+    # First half of the next point of the level above
+    carry: Optional[Tuple[np.ndarray, bool]] = None
 
+    def __init__(self, capacity: int, series: int) -> None:
+        self.stats = np.zeros((capacity, 3, series))
+        self.marks = np.zeros(capacity, dtype=bool)
 
+    def first(self) -> int:
+        return max(0, self.total - len(self.stats))
+
+    def append(self, stats: np.ndarray, mark: bool) -> None:
+        self.stats[self.total % len(self.stats)] = stats
+        self.marks[self.total % len(self.stats)] = mark
+        self.total += 1
+
+    # Points [begin, end), which must still be stored
+    def get(self, begin: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+        indices = np.arange(begin, end) % len(self.stats)
+        return (self.stats[indices], self.marks[indices])
+
+
+def merge(a: np.ndarray, a_weight: int, b: np.ndarray, b_weight: int) -> np.ndarray:
+    merged = np.empty_like(a)
+    merged[MIN] = np.minimum(a[MIN], b[MIN])
+    merged[MAX] = np.maximum(a[MAX], b[MAX])
+    merged[MEAN] = (a[MEAN] * a_weight + b[MEAN] * b_weight) / (a_weight + b_weight)
+    return merged
+
+
+# Every collected point, at resolutions 1, 2, 4, ... Each level keeps a bounded
+# number of points, so memory grows with the log of the run length, and any
+# range can be shown from the finest level that still covers it.
+class PopulationHistory:
+    levels: List[HistoryLevel]
+    capacity: int
+    series: int
+
+    def __init__(self, capacity: int, series: int) -> None:
+        self.capacity = capacity
+        self.series = series
+        self.levels = [HistoryLevel(capacity, series)]
+
+    def count(self) -> int:
+        return self.levels[0].total
+
+    def append(self, values: List[float], mark: bool) -> None:
+        assert len(values) == self.series
+        stats = np.tile(np.asarray(values, dtype=float), (3, 1))
+        for k, level in enumerate(self.levels):
+            level.append(stats, mark)
+            if level.carry is None:
+                level.carry = (stats, mark)
+                return
+            (previous, previous_mark) = level.carry
+            level.carry = None
+            stats = merge(previous, 2**k, stats, 2**k)
+            mark = previous_mark or mark
+            if k + 1 == len(self.levels):
+                self.levels.append(HistoryLevel(self.capacity, self.series))
+
+    # The collected points not yet in level k, merged into one partial point
+    def tail(self, k: int) -> Optional[Tuple[np.ndarray, bool, int]]:
+        merged: Optional[Tuple[np.ndarray, bool, int]] = None
+        for j in reversed(range(k)):
+            carry = self.levels[j].carry
+            if carry is None:
+                continue
+            if merged is None:
+                merged = (carry[0], carry[1], 2**j)
+            else:
+                merged = (
+                    merge(merged[0], merged[2], carry[0], 2**j),
+                    merged[1] or carry[1],
+                    merged[2] + 2**j,
+                )
+        return merged
+
+    # Points covering the collected points [begin, end) at the finest level
+    # that still stores them with at most max_points points. Returns the level
+    # and, for each point, its first collected point, aggregates and mark.
+    def query(
+        self, begin: int, end: int, max_points: int
+    ) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+        for k, level in enumerate(self.levels):
+            first = begin >> k
+            last = min(-(-end >> k), level.total)
+            if last - first <= max_points and first >= level.first():
+                break
+        stats, marks = level.get(first, last)
+        tail = self.tail(k) if end > level.total << k else None
+        if tail is not None:
+            stats = np.concatenate((stats, tail[0][None]))
+            marks = np.append(marks, tail[1])
+            last += 1
+        return (k, np.arange(first, last) << k, stats, marks)
+
+
+# Population graph over any range of the run. By default it follows the last
+# points that fit in its width; it can zoom out to the whole run and pan. The
+# geometry is only rebuilt when a point, a mark or the view changes, every
+# other frame draws the cached ShapeElementList.
 class HistoricalData(Updatable):
-    data: List[DataPoint]
+    history: PopulationHistory
     time_till_collect: float
     data_collector: Callable[[], List[float]]
     bottom_left: Point
     size: Vector
     mode: GraphMode = GraphMode.AreaPct
     pending_mark: bool = False
+    shapes: Optional[ShapeElementList] = None
+    # Collected points shown, None for the whole run
+    span: Optional[int]
+    # Last collected point shown, None to follow the newest one
+    end: Optional[int] = None
+    range_text: Text
 
     def __init__(
         self,
@@ -37,24 +149,42 @@ class HistoricalData(Updatable):
         size: Vector,
         data_collector: Callable[[], List[float]],
     ):
-        self.data = []
         self.time_till_collect = COLLECT_INTERVAL
         self.data_collector = data_collector
         self.bottom_left = bottom_left
         self.size = size
-        self.collect_data()
+        first = self.data_collector()
+        # Twice what fits in the graph, so the finer levels have some slack
+        self.history = PopulationHistory(2 * self.capacity(), len(first))
+        self.span = self.capacity()
+        self.range_text = Text(
+            "",
+            bottom_left[0],
+            bottom_left[1] + size[1] + 15,
+            arcade.color.BLACK,
+            9,
+        )
+        self.append(first)
+
+    # Points that fit in the graph
+    def capacity(self) -> int:
+        return int(self.size[0] // DX)
 
     def value_count(self) -> int:
-        return len(self.data[0].values)
+        return self.history.series
 
     def add_vertical_mark(self) -> None:
-        self.pending_mark = True
+        if not self.pending_mark:
+            self.pending_mark = True
+            self.shapes = None
 
-    def collect_data(self):
-        self.data.append(DataPoint(self.data_collector(), self.pending_mark))
+    def append(self, values: List[float]) -> None:
+        self.history.append(values, self.pending_mark)
         self.pending_mark = False
-        if len(self.data) > 1:
-            assert len(self.data[-1].values) == len(self.data[-2].values)
+        self.shapes = None
+
+    def collect_data(self):
+        self.append(self.data_collector())
 
     def update(self):
         self.time_till_collect -= DT
@@ -62,7 +192,42 @@ class HistoricalData(Updatable):
             self.time_till_collect += COLLECT_INTERVAL
             self.collect_data()
 
-    def draw_outline(self) -> None:
+    # Collected points [begin, end) currently shown
+    def view_range(self) -> Tuple[int, int]:
+        count = self.history.count()
+        span = self.span if self.span is not None else max(count, self.capacity())
+        end = self.end if self.end is not None else count
+        return (max(0, end - span), max(end, span))
+
+    def set_view(self, span: Optional[int], end: Optional[int]) -> None:
+        count = self.history.count()
+        if span is not None and span >= count:
+            span = None
+        if end is not None and (end >= count or span is None):
+            end = None
+        self.span = span
+        self.end = end
+        self.shapes = None
+
+    def zoom_in(self) -> None:
+        begin, end = self.view_range()
+        self.set_view(max(self.capacity(), (end - begin) // 2), self.end)
+
+    def zoom_out(self) -> None:
+        begin, end = self.view_range()
+        self.set_view(2 * (end - begin), self.end)
+
+    def pan(self, direction: int) -> None:
+        begin, end = self.view_range()
+        if self.span is None:
+            return
+        shift = direction * self.span // 2
+        self.set_view(self.span, max(self.span, min(end, self.history.count()) + shift))
+
+    def whole_run(self) -> None:
+        self.set_view(None, None)
+
+    def add_outline(self, shapes: ShapeElementList) -> None:
         (x, y) = self.bottom_left
         (w, h) = self.size
         for line in [
@@ -82,58 +247,91 @@ class HistoricalData(Updatable):
                 (x + w - 10, y + 7),
             ],
         ]:
-            arcade.draw_line_strip(line, arcade.color.BLACK, 3)
+            shapes.append(arcade.create_line_strip(line, arcade.color.BLACK, 3))
 
-    def draw_lines(self) -> None:
+    # Each series is its mean, inside a lighter band from its min to its max
+    def add_lines(
+        self, shapes: ShapeElementList, xs: np.ndarray, stats: np.ndarray
+    ) -> None:
         (x, y) = self.bottom_left
         for i in range(self.value_count()):
-            points = []
-            for di in range(len(self.data)):
-                points.append((x + di * DX, y + self.data[di].values[i] * 10))
-            arcade.draw_line_strip(points, COLORS[i], 2)
+            band = np.empty((2 * len(xs), 2))
+            band[0::2] = np.column_stack((xs, y + stats[:, MIN, i] * 10))
+            band[1::2] = np.column_stack((xs, y + stats[:, MAX, i] * 10))
+            color = (*COLORS[i][:3], 80)
+            shapes.append(
+                arcade.create_triangles_filled_with_colors(
+                    band.tolist(), [color] * len(band)
+                )
+            )
+            points = np.column_stack((xs, y + stats[:, MEAN, i] * 10))
+            shapes.append(arcade.create_line_strip(points.tolist(), COLORS[i], 2))
 
-    def draw_area_pct(self) -> None:
+    # Each area is a triangle strip between its cumulative share and the
+    # previous one, held flat for one more point at the end
+    def add_area_pct(
+        self, shapes: ShapeElementList, xs: np.ndarray, stats: np.ndarray
+    ) -> None:
         (x, y) = self.bottom_left
         (w, h) = self.size
-        points = []
+        values = stats[:, MEAN]
+        values = np.vstack((values, values[-1:]))
+        step = xs[-1] - xs[-2] if len(xs) > 1 else DX
+        xs = np.append(xs, min(x + w, xs[-1] + step))
+        tot = values.sum(axis=1, keepdims=True)
+        pct = np.divide(
+            np.cumsum(values, axis=1),
+            tot,
+            out=np.zeros_like(values),
+            where=tot > 0,
+        )
+        lower = np.zeros(len(values))
         for i in range(self.value_count()):
-            points.append([])
-        for di in range(len(self.data)):
-            tot = sum(self.data[di].values)
-            cur = 0
-            for i in range(self.value_count()):
-                cur += self.data[di].values[i]
-                pct = cur / tot if tot > 0 else 0
-                points[i].append((x + di * DX, y + pct * h))
-        for ps in points:
-            ps.append((ps[-1][0] + DX, ps[-1][1]))
-        points.insert(0, [(x, y), (x + DX * len(self.data), y)])
-        for i in range(len(points) - 1):
-            arcade.draw_polygon_filled(
-                points[i] + points[i + 1][::-1],
-                COLORS[i],
+            upper = pct[:, i]
+            points = np.empty((2 * len(values), 2))
+            points[0::2] = np.column_stack((xs, y + lower * h))
+            points[1::2] = np.column_stack((xs, y + upper * h))
+            shapes.append(
+                arcade.create_triangles_filled_with_colors(
+                    points.tolist(), [COLORS[i]] * len(points)
+                )
             )
+            lower = upper
 
-    def draw_mark(self, di: int) -> None:
+    def add_mark(self, shapes: ShapeElementList, mark_x: float) -> None:
         (x, y) = self.bottom_left
         (w, h) = self.size
-        arcade.draw_line(x + di * DX, y, x + di * DX, y + h + 10, arcade.color.BLACK, 1)
+        shapes.append(
+            arcade.create_line(mark_x, y, mark_x, y + h + 10, arcade.color.BLACK, 1)
+        )
 
-    def draw_marks(self) -> None:
-        for di in range(len(self.data)):
-            if self.data[di].vertical_mark:
-                self.draw_mark(di)
-        if self.pending_mark:
-            self.draw_mark(len(self.data))
-
-    def draw(self) -> None:
+    def build_shapes(self) -> ShapeElementList:
+        (x, y) = self.bottom_left
         (w, h) = self.size
-        while len(self.data) * DX > w:
-            self.data.pop(0)
+        shapes = ShapeElementList()
+        begin, end = self.view_range()
+        scale = w / (end - begin)
+        _, starts, stats, marks = self.history.query(begin, end, self.capacity())
+        xs = x + (starts - begin) * scale
         match self.mode:
             case GraphMode.Lines:
-                self.draw_lines()
+                self.add_lines(shapes, xs, stats)
             case GraphMode.AreaPct:
-                self.draw_area_pct()
-        self.draw_outline()
-        self.draw_marks()
+                self.add_area_pct(shapes, xs, stats)
+        self.add_outline(shapes)
+        for mark_x in xs[marks]:
+            self.add_mark(shapes, float(mark_x))
+        if self.pending_mark and self.end is None:
+            self.add_mark(shapes, x + (self.history.count() - begin) * scale)
+        self.range_text.text = (
+            f"{begin * COLLECT_INTERVAL / 60:.1f} to "
+            f"{min(end, self.history.count()) * COLLECT_INTERVAL / 60:.1f} min "
+            "(- and = zoom, [ and ] pan, 0 whole run)"
+        )
+        return shapes
+
+    def draw(self) -> None:
+        if self.shapes is None:
+            self.shapes = self.build_shapes()
+        self.shapes.draw()
+        self.range_text.draw()
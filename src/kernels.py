@@ -0,0 +1,195 @@
+from agents import Agent, AgentWithHunger, Herbivore, Carnivore, Map
+from constants import DT, INTERACTION_RADIUS
+from enum import Enum
+from typing import Callable, List, Sequence, Tuple, Type
+import numpy as np
+
+# Batched versions of the per-tick work of the agents that move. At the start
+# of the tick, for each type in KERNELS, the forces of Herbivore and Carnivore
+# calculate_external_force, the motion of Agent.update and the hunger of
+# AgentWithHunger.update are computed for all of them at once, from the state
+# at that moment. Each agent is then marked as batched, so its own update only
+# runs what is left, like dying, procreating and its state machine.
+
+
+# Structure of arrays with the motion state of every agent of a type
+class AgentArrays:
+    agents: List[Agent]
+    position: np.ndarray
+    velocity: np.ndarray
+    base_force: np.ndarray
+    idle_speed: np.ndarray
+    idle: np.ndarray
+
+    def __init__(self, agents: Sequence[Agent], idle_state: Enum) -> None:
+        self.agents = list(agents)
+        n = len(self.agents)
+        # From lists, setting rows one by one is several times slower
+        self.position = np.array([a.position for a in self.agents]).reshape(n, 2)
+        self.velocity = np.array([a.velocity for a in self.agents]).reshape(n, 2)
+        self.base_force = np.array([a.base_force for a in self.agents]).reshape(n, 2)
+        self.idle_speed = np.array([a.idle_speed for a in self.agents])  # type: ignore
+        self.idle = np.array(
+            [a.state is idle_state for a in self.agents], dtype=bool  # type: ignore
+        )
+
+
+# Every (row, col) pair of agents in the same or neighbouring grid cells,
+# rows only among the idle ones, with vec pointing from row to col and its
+# norm. Only pairs at most INTERACTION_RADIUS and more than 0 apart are kept,
+# which leaves out the agents paired with themselves.
+def neighbour_pairs(
+    arrays: AgentArrays,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    position = arrays.position
+    cells = np.floor(position / INTERACTION_RADIUS).astype(np.int64)
+    # One key per cell, with an empty border so neighbours never wrap around
+    cells -= cells.min(axis=0) - 1
+    height = cells[:, 1].max() + 2
+    keys = cells[:, 0] * height + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    idle = np.flatnonzero(arrays.idle)
+    all_rows = []
+    all_cols = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            target = keys[idle] + dx * height + dy
+            first = np.searchsorted(sorted_keys, target, "left")
+            counts = np.searchsorted(sorted_keys, target, "right") - first
+            # The indices first[k] .. first[k] + counts[k] - 1, one after the
+            # other
+            ends = np.cumsum(counts)
+            offsets = np.arange(ends[-1] if len(ends) > 0 else 0)
+            offsets += np.repeat(first - (ends - counts), counts)
+            all_rows.append(np.repeat(idle, counts))
+            all_cols.append(order[offsets])
+    rows = np.concatenate(all_rows)
+    cols = np.concatenate(all_cols)
+    vec = position[cols] - position[rows]
+    norm2 = (vec**2).sum(axis=1)
+    valid = (norm2 <= INTERACTION_RADIUS**2) & (norm2 > 0)
+    (rows, cols, vec) = (rows[valid], cols[valid], vec[valid])
+    return (rows, cols, vec, np.sqrt(norm2[valid]))
+
+
+# The sum over the pairs of vec / norm * mult, for each row
+def sum_pairs(
+    n: int, rows: np.ndarray, vec: np.ndarray, norm: np.ndarray, mult: np.ndarray
+) -> np.ndarray:
+    scale = mult / norm
+    forces = np.empty((n, 2))
+    forces[:, 0] = np.bincount(rows, vec[:, 0] * scale, minlength=n)
+    forces[:, 1] = np.bincount(rows, vec[:, 1] * scale, minlength=n)
+    return forces
+
+
+def herbivore_forces(arrays: AgentArrays) -> np.ndarray:
+    (rows, _, vec, norm) = neighbour_pairs(arrays)
+    max_dist = INTERACTION_RADIUS
+    desired_dist = 150
+    buffer = 50
+    # I want to get closer
+    far_mult = (
+        np.clip(max_dist - norm, 0, None) / (max_dist - desired_dist - buffer)
+    ) ** 0.75 * 2
+    # Too close, I want to get further
+    near_mult = (
+        np.clip(desired_dist - buffer - norm, 0, None) / (desired_dist - buffer)
+    ) ** 0.5 * -5
+    mult = np.where(norm > desired_dist + buffer, far_mult, 0.0) + np.where(
+        norm < desired_dist - buffer, near_mult, 0.0
+    )
+    mult *= arrays.idle_speed[rows]
+    return sum_pairs(len(arrays.agents), rows, vec, norm, mult)
+
+
+def carnivore_forces(arrays: AgentArrays) -> np.ndarray:
+    (rows, _, vec, norm) = neighbour_pairs(arrays)
+    max_dist = INTERACTION_RADIUS
+    mult = (np.clip(max_dist - norm, 0, None) / max_dist) ** 1.2 * 5
+    mult *= arrays.idle_speed[rows]
+    # Repel, so the vector goes from col to row
+    forces = sum_pairs(len(arrays.agents), rows, vec, norm, -mult)
+    # Same as max_norm(external_force, self.idle_speed)
+    return limit_norm(forces, arrays.idle_speed)
+
+
+# Same as max_norm on every row of v
+def limit_norm(v: np.ndarray, max_len: np.ndarray) -> np.ndarray:
+    factor = (v**2).sum(axis=1) / np.where(max_len == 0, 1.0, max_len**2)
+    shrink = np.where(factor > 1, 1 / np.sqrt(np.maximum(factor, 1)), 1.0)
+    return v * np.where(max_len == 0, 0.0, shrink)[:, None]
+
+
+KERNELS: List[
+    Tuple[Type[AgentWithHunger], Enum, Callable[[AgentArrays], np.ndarray]]
+] = [
+    (Herbivore, Herbivore.State.Idle, herbivore_forces),
+    (Carnivore, Carnivore.State.Idle, carnivore_forces),
+]
+
+
+# AgentWithHunger.update before it calls its parent, for all the agents of a
+# type. Returns the new hunger and health.
+def build_hunger(
+    agent_type: Type[AgentWithHunger], hunger: np.ndarray, health: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    hunger = np.minimum(100, hunger + agent_type.hunger_buildup * DT)
+    starving = hunger >= 100
+    health = np.where(starving, health - agent_type.hunger_damage * DT, health)
+    # add_health, which does nothing to the dead
+    regen = ~starving & (hunger < 50.0) & (health > 0)
+    gain = np.minimum(100 - health, agent_type.satisfied_health_regen * DT)
+    return (hunger, np.where(regen, health + gain, health))
+
+
+# Can be used as Map.kernel. The agents in `others`, which are not in the map,
+# pull and push the map's agents but are not updated themselves.
+def update_movers(map: Map, others: Sequence[Agent] = ()) -> None:
+    for agent_type, idle_state, kernel in KERNELS:
+        own = list(map.agents(agent_type))
+        n = len(own)
+        if n == 0:
+            continue
+        arrays = AgentArrays(
+            own + [a for a in others if a.type is agent_type], idle_state
+        )
+        arrays.idle[n:] = False
+        forces = kernel(arrays)[:n]
+        idle = arrays.idle[:n]
+        # calculate_external_force, which only pushes the idle ones
+        forces[~idle] = 0
+        max_speed = np.where(idle, arrays.idle_speed[:n], [a.max_speed for a in own])
+        (hunger, health) = build_hunger(
+            agent_type,
+            np.array([a.hunger for a in own]),  # type: ignore
+            np.array([a.health for a in own]),  # type: ignore
+        )
+        # Agent.update
+        base_force = arrays.base_force[:n]
+        velocity = limit_norm(
+            arrays.velocity[:n] + (base_force + forces) * DT, max_speed
+        )
+        base_force = base_force + (forces - base_force) * DT
+        position = arrays.position[:n] + velocity
+        # Map.update also does this after each update, but the loop skips the
+        # agent after any that is killed, which must not stay in its old cell
+        grid = map.grids[agent_type]
+        for agent, xy, v, f, speed, h, hp in zip(
+            own,
+            position.tolist(),
+            velocity.tolist(),
+            base_force.tolist(),
+            max_speed.tolist(),
+            hunger.tolist(),
+            health.tolist(),
+        ):
+            agent.position = xy
+            agent.velocity = v
+            agent.base_force = f
+            agent.max_speed = speed
+            agent.hunger = h  # type: ignore
+            agent.health = hp  # type: ignore
+            agent.batched = True
+            grid.move(agent)
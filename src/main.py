@@ -1,27 +1,43 @@
 import arcade, arcade.color
 from arcade import Window, key, Text, Camera
-from constants import SCREEN_WIDTH, SCREEN_HEIGHT
+from constants import SCREEN_WIDTH, SCREEN_HEIGHT, MAP_SIZE, MAX_PER_TYPE
 import agents
 from agents import Map, Grass, Herbivore, Carnivore, Agent, Carcass
 from historical_data import HistoricalData
-from typing import List, Type, Tuple
+from typing import List, Optional, Set, Type, Tuple
 from logs import Logs
 from slider import Slider
+from simulation import Simulation, PARAMETERS, run_headless
+from profiler import PROFILER, ProfilerHud
+from events import Cap
+from scheduler import FixedStepScheduler
+from worker import (
+    SimulationWorker,
+    SnapshotView,
+    Snapshot,
+    Event,
+    CreateAgent,
+    KillAt,
+    SetParam,
+    SetSpeed,
+    SaveCheckpoint,
+    LoadCheckpoint,
+)
 import argparse
 
-SPEED_MULTIPLIER: int = 1
-
 
 class Game(Window):
-    map: Map
+    sim: Simulation
+    # Set when the simulation runs in another process, see worker.py
+    worker: Optional[SimulationWorker] = None
+    view: SnapshotView
+    snapshot: Snapshot
     cur_agent: Type[Agent] = Grass
     graph: HistoricalData
-    previous_pause_val: int = 0
+    previous_pause_val: float = 0
+    scheduler: FixedStepScheduler
     gui_camera: Camera
     map_camera: Camera
-    score: float = 0
-    time_no_modif: float = 0
-    prev_count: List[float] = [0, 0, 0]
 
     def __init__(self, args: argparse.Namespace) -> None:
         super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, "Equilibrium")  # type: ignore
@@ -40,30 +56,18 @@ class Game(Window):
             SCREEN_HEIGHT - 80,
             arcade.color.BLACK,
         )
+        self.checkpoint_text = Text(
+            "Press K to save a checkpoint, L to load it. F3 shows the profiler.",
+            10,
+            SCREEN_HEIGHT - 100,
+            arcade.color.BLACK,
+        )
+        self.checkpoint_path: str = args.checkpoint
         self.grass_count = Text("", 10, SCREEN_HEIGHT - 120, arcade.color.BLACK, 12)
         self.herbivore_count = Text("", 10, SCREEN_HEIGHT - 140, arcade.color.BLACK, 12)
         self.carnivore_count = Text("", 10, SCREEN_HEIGHT - 160, arcade.color.BLACK, 12)
 
-        for i, s_args in enumerate(
-            [
-                (agent, name, f"{agent.__name__} {desc}", min_, max_)
-                for (name, desc, min_, max_) in [
-                    ("hunger_buildup", "hunger increase", 1, 10),
-                    ("hunger_damage", "damage from hunger", 5, 25),
-                    ("satisfied_health_regen", "health regen when well-fed", 1, 10),
-                    ("mean_age", "mean lifespan", 50, 300),
-                    ("procreate_mean", "mean procreation time", 50, 300),
-                    ("health_to_hunger", "feeding efficiency", 0.5, 1.5),
-                    ("mean_attack_damage", "mean attack damage", 5, 50),
-                ]
-                for agent in (Herbivore, Carnivore)
-            ]
-            + [
-                (Carnivore, "mean_chase_speed", "Carnivore mean chase speed", 0.5, 3),
-                (Grass, "mean_age", "Grass mean lifespan", 100, 2000),
-                (Carcass, "mean_rot_speed", "Carcass mean rot speed", 1, 20),
-            ]
-        ):
+        for i, s_args in enumerate(PARAMETERS):
             Slider(
                 10,
                 SCREEN_HEIGHT / 3 + 20 * i,
@@ -71,16 +75,20 @@ class Game(Window):
                 *s_args,
             )
 
-        map_size = 1000
-        self.map = Map(map_size)
-        if args.herbivores_only:
-            self.map.gen_random_agents(30, [0, 1, 0])
-        elif args.carnivores_only:
-            self.map.gen_random_agents(20, [0, 0, 1])
+        self.scheduler = FixedStepScheduler(0 if args.start_paused else 1)
+        if args.worker:
+            self.worker = SimulationWorker(args, self.scheduler.speed)
+            self.view = SnapshotView()
+            self.snapshot = self.worker.snapshot()
+            self.sync_params(None)
         else:
-            self.map.gen_random_agents(50, [11, 5, 2])
+            self.sim = Simulation(args)
+            self.sim.on_extinction = self.on_extinction
+            self.sim.events.subscribe(
+                Cap, lambda caps: self.on_cap({cap.agent.__name__ for cap in caps})
+            )
         self.map_camera = Camera(SCREEN_WIDTH, SCREEN_HEIGHT)
-        self.map_camera.scale = map_size / 800.0
+        self.fit_map()
         self.gui_camera = Camera(SCREEN_WIDTH, SCREEN_HEIGHT)
         graph_bl = (SCREEN_WIDTH - 450, SCREEN_HEIGHT - 300)
         self.graph = HistoricalData(graph_bl, (400, 200), self.get_data)
@@ -91,10 +99,14 @@ class Game(Window):
             "", graph_bl[0], graph_bl[1] - 60, arcade.color.BLACK, 15
         )
         self.logs: Logs = Logs((graph_bl[0], graph_bl[1] - 120), (200, 300))
+        self.profiler_hud = ProfilerHud((graph_bl[0], graph_bl[1] - 430))
+        if self.worker is None:
+            self.sim.updatables += [self.graph, self.logs]
         self.update_agent_text()
         self.update_counts()
 
     def on_draw(self):
+        start = PROFILER.start()
         arcade.start_render()
         self.gui_camera.use()
         Slider.draw_all()
@@ -103,6 +115,7 @@ class Game(Window):
             self.cur_agent_text,
             self.tab_text,
             self.right_click_text,
+            self.checkpoint_text,
             self.grass_count,
             self.herbivore_count,
             self.carnivore_count,
@@ -112,53 +125,141 @@ class Game(Window):
             self.logs,
         ]:
             drawable.draw()
+        if PROFILER.enabled:
+            self.profiler_hud.draw()
+        PROFILER.stop("draw", "gui", start)
+        start = PROFILER.start()
         self.map_camera.use()
-        self.map.draw()
+        if self.worker is not None:
+            self.view.draw()
+        else:
+            self.map.draw()
+        PROFILER.stop("draw", "map", start)
+        PROFILER.end_frame()
+
+    @property
+    def map(self) -> Map:
+        return self.sim.map
+
+    def get_data(self) -> List[float]:
+        if self.worker is not None:
+            return self.snapshot.counts
+        return self.sim.get_data()
+
+    # Zooms out until the whole map fits, it changes when a checkpoint loads
+    def fit_map(self) -> None:
+        if self.worker is not None:
+            size = self.snapshot.map_size
+        else:
+            size = self.map.width
+        self.map_camera.scale = max(size, MAP_SIZE) / 800.0
 
     def on_update(self, delta_time: float):
-        self.time_no_modif += SPEED_MULTIPLIER * delta_time
-        self.score += SPEED_MULTIPLIER * delta_time
-        for _ in range(SPEED_MULTIPLIER):
-            self.map.update()
+        if self.worker is not None:
+            self.update_from_worker()
+        else:
+            self.scheduler.advance(delta_time, self.sim.step)
+        self.fit_map()
+        self.update_counts()
+        if PROFILER.enabled:
+            self.profiler_hud.update(delta_time)
+
+    def update_from_worker(self):
+        assert self.worker is not None
+        previous = self.snapshot
+        self.snapshot = self.worker.snapshot()
+        self.sync_params(previous)
+        # The graph and logs follow simulated time, like the updatables do
+        for _ in range(self.snapshot.ticks - previous.ticks):
             self.graph.update()
             self.logs.update()
-        self.update_counts()
+        self.view.update(self.snapshot)
+        for event in self.worker.poll_events():
+            self.on_worker_event(event)
+
+    # The sliders show the classes of this process, so parameters changed in
+    # the worker, as when a checkpoint loads, are copied to them. Only the
+    # changed ones, or a click the worker did not apply yet would be undone.
+    def sync_params(self, previous: Optional[Snapshot]):
+        for i, (agent, field, *_) in enumerate(PARAMETERS):
+            value = self.snapshot.params[i]
+            if previous is None or previous.params[i] != value:
+                setattr(agent, field, value)
+
+    def on_worker_event(self, event: Event):
+        match event.kind:
+            case "created":
+                self.record_modification()
+                self.log_created(event.text)
+            case "killed":
+                self.record_modification()
+                self.logs.log(f"Manually killed {event.text}")
+            case "extinction":
+                self.logs.log(f"Extinction of {event.text}")
+            case "saved":
+                self.logs.log(f"Saved {event.text}")
+            case "loaded":
+                self.record_modification()
+                self.logs.log(f"Loaded {event.text}")
+            case "error":
+                self.logs.log(event.text)
+            case "cap":
+                self.on_cap({event.text})
+
+    def on_close(self):
+        if self.worker is not None:
+            self.worker.stop()
+        else:
+            self.sim.close()
+        super().on_close()
 
     def update_agent_text(self):
         self.cur_agent_text.text = (
             f"Click to create: {self.cur_agent.__name__} (use G, H, C to change)"
         )
 
-    def get_data(self) -> List[float]:
-        return [
-            len(self.map.agents(Grass)),
-            len(self.map.agents(Herbivore)),
-            len(self.map.agents(Carnivore)),
-        ]
-
     def on_extinction(self, agent: Type[Agent]):
         self.logs.log(f"Extinction of {agent.__name__}")
 
+    # Creations refused because of the population cap, logged once per streak
+    def on_cap(self, names: Set[str]):
+        for name in sorted(names):
+            text = f"Too many {name}, creation refused"
+            last_log = self.logs.last_log()
+            if last_log is not None and last_log.raw_text == text:
+                last_log.time_log = self.logs.cur_time
+            else:
+                self.logs.log(text)
+
     def update_counts(self):
-        new_count = self.get_data()
+        if self.worker is not None:
+            new_count = self.snapshot.counts
+            state = self.snapshot
+        else:
+            new_count = self.sim.update_counts()
+            state = self.sim
         [grass_count, herbivore_count, carnivore_count] = new_count
         self.grass_count.text = f"Grass total: {grass_count}"
         self.herbivore_count.text = f"Herbivores total: {herbivore_count}"
         self.carnivore_count.text = f"Carnivores total: {carnivore_count}"
-        self.simulation_speed.text = f"Simulation speed: {SPEED_MULTIPLIER}x (use arrows to change, P to pause/resume)"
+        self.simulation_speed.text = f"Simulation speed: {self.scheduler.speed:g}x, achieved {self.achieved_speed():.1f}x (use arrows to change, P to pause/resume)"
         self.time_no_modif_text.text = (
-            f"Time without modification: {self.time_no_modif:.1f}s"
+            f"Time without modification: {state.time_no_modif:.1f}s"
         )
-        self.score_text.text = f"Score: {self.score:.0f}"
-        if min(*new_count) == 0:
-            self.score = 0
-        for i, agent_type in enumerate([Grass, Herbivore, Carnivore]):
-            if new_count[i] == 0 and self.prev_count[i] != 0:
-                self.on_extinction(agent_type)
-        self.prev_count = new_count
+        self.score_text.text = f"Score: {state.score:.0f}"
+
+    def achieved_speed(self) -> float:
+        if self.worker is not None:
+            return self.snapshot.achieved
+        return self.scheduler.achieved
+
+    def set_speed(self, speed: float):
+        self.scheduler.set_speed(speed)
+        if self.worker is not None:
+            self.worker.send(SetSpeed(self.scheduler.speed))
 
     def on_key_press(self, symbol: int, modifiers: int):
-        global SPEED_MULTIPLIER
+        speed = self.scheduler.speed
         if symbol == key.H:
             self.cur_agent = Herbivore
         elif symbol == key.G:
@@ -166,17 +267,48 @@ class Game(Window):
         elif symbol == key.C:
             self.cur_agent = Carnivore
         elif symbol == key.RIGHT:
-            SPEED_MULTIPLIER = SPEED_MULTIPLIER + 1
+            self.set_speed(speed + 1)
         elif symbol == key.LEFT:
-            SPEED_MULTIPLIER = max(0, SPEED_MULTIPLIER - 1)
+            self.set_speed(speed - 1)
         elif symbol == key.P:
-            if SPEED_MULTIPLIER == 0:
-                SPEED_MULTIPLIER = self.previous_pause_val
+            if speed == 0:
+                self.set_speed(self.previous_pause_val)
             else:
-                self.previous_pause_val = SPEED_MULTIPLIER
-                SPEED_MULTIPLIER = 0
+                self.previous_pause_val = speed
+                self.set_speed(0)
         elif symbol == key.TAB:
             agents.SHOW_BARS = not agents.SHOW_BARS
+        elif symbol == key.F3:
+            PROFILER.toggle()
+        elif symbol == key.MINUS:
+            self.graph.zoom_out()
+        elif symbol == key.EQUAL:
+            self.graph.zoom_in()
+        elif symbol == key.BRACKETLEFT:
+            self.graph.pan(-1)
+        elif symbol == key.BRACKETRIGHT:
+            self.graph.pan(1)
+        elif symbol == key.KEY_0:
+            self.graph.whole_run()
+        elif symbol == key.K and self.worker is not None:
+            self.worker.send(SaveCheckpoint(self.checkpoint_path))
+        elif symbol == key.L and self.worker is not None:
+            self.worker.send(LoadCheckpoint(self.checkpoint_path))
+        elif symbol == key.K:
+            try:
+                self.map.save_checkpoint(self.checkpoint_path)
+            except OSError as e:
+                self.logs.log(f"Could not save {self.checkpoint_path}: {e}")
+            else:
+                self.logs.log(f"Saved {self.checkpoint_path}")
+        elif symbol == key.L:
+            try:
+                self.sim.load_checkpoint(self.checkpoint_path)
+            except (OSError, ValueError) as e:
+                self.logs.log(f"Could not load {self.checkpoint_path}: {e}")
+            else:
+                self.logs.log(f"Loaded {self.checkpoint_path}")
+                self.record_modification()
         else:
             return
         self.update_agent_text()
@@ -201,39 +333,61 @@ class Game(Window):
                     if last_log.time_elapsed(self.logs.cur_time) < 10:
                         score_change = 0
                     last_log.time_log = self.logs.cur_time
-                self.record_modification(score_change)
-        mx, my = self.adjust_xy_to_map(x, y)
-        if button == arcade.MOUSE_BUTTON_LEFT and self.map.collides_with_point(
-            (mx, my)
-        ):
-            if self.map.create_agent(mx - 25, my + 25, self.cur_agent):
-                self.record_modification()
-                last_log = self.logs.last_log()
-                name = self.cur_agent.__name__
-                if (
-                    last_log is not None
-                    and last_log.time_elapsed(self.logs.cur_time) < 30
-                    and last_log.raw_text.startswith("Created")
-                    and last_log.raw_text.endswith(name)
-                ):
-                    num = int(last_log.raw_text.split(" ", 3)[1])
-                    last_log.raw_text = f"Created {num + 1} {name}"
-                    last_log.time_log = self.logs.cur_time
+                agent, field = next(
+                    (a, f) for (a, f, name, *_) in PARAMETERS if name == changed
+                )
+                if self.worker is not None:
+                    self.worker.send(
+                        SetParam(agent, field, getattr(agent, field), score_change)
+                    )
                 else:
-                    self.logs.log(f"Created 1 {name}")
-        elif button == arcade.MOUSE_BUTTON_RIGHT and self.map.collides_with_point(
-            (mx, my)
-        ):
-            to_kill = self.map.find_at_point(mx, my)
-            for agent in to_kill:
-                agent.kill()
+                    self.sim.set_param(
+                        agent, field, getattr(agent, field), score_change
+                    )
+                self.graph.add_vertical_mark()
+        mx, my = self.adjust_xy_to_map(x, y)
+        if not self.on_map(mx, my):
+            return
+        if button == arcade.MOUSE_BUTTON_LEFT and self.worker is not None:
+            self.worker.send(CreateAgent(mx - 25, my + 25, self.cur_agent))
+        elif button == arcade.MOUSE_BUTTON_RIGHT and self.worker is not None:
+            self.worker.send(KillAt(mx, my))
+        elif button == arcade.MOUSE_BUTTON_LEFT:
+            if self.sim.create_agent(mx - 25, my + 25, self.cur_agent):
+                self.graph.add_vertical_mark()
+                self.log_created(self.cur_agent.__name__)
+        elif button == arcade.MOUSE_BUTTON_RIGHT:
+            for agent in self.sim.kill_at(mx, my):
                 self.logs.log(f"Manually killed {agent.__class__.__name__}")
-                self.record_modification()
+                self.graph.add_vertical_mark()
+
+    def on_map(self, x: float, y: float) -> bool:
+        if self.worker is not None:
+            half = self.snapshot.map_size / 2
+            return (
+                abs(x - SCREEN_WIDTH / 2) <= half and abs(y - SCREEN_HEIGHT / 2) <= half
+            )
+        return self.map.collides_with_point((x, y))
+
+    def log_created(self, name: str):
+        last_log = self.logs.last_log()
+        if (
+            last_log is not None
+            and last_log.time_elapsed(self.logs.cur_time) < 30
+            and last_log.raw_text.startswith("Created")
+            and last_log.raw_text.endswith(name)
+        ):
+            num = int(last_log.raw_text.split(" ", 3)[1])
+            last_log.raw_text = f"Created {num + 1} {name}"
+            last_log.time_log = self.logs.cur_time
+        else:
+            self.logs.log(f"Created 1 {name}")
 
+    # The worker process applies the score change itself
     def record_modification(self, score_change: int = 10):
         self.graph.add_vertical_mark()
-        self.time_no_modif = 0
-        self.score = max(0, self.score - score_change)
+        if self.worker is None:
+            self.sim.record_modification(score_change)
 
 
 def main():
@@ -241,10 +395,59 @@ def main():
     parser.add_argument("--herbivores-only", action="store_true")
     parser.add_argument("--carnivores-only", action="store_true")
     parser.add_argument("--start-paused", action="store_true")
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Run without a window, as fast as possible",
+    )
+    parser.add_argument(
+        "--ticks", type=int, default=3600, help="Ticks to simulate when headless"
+    )
+    parser.add_argument("--load", help="Start from this checkpoint")
+    parser.add_argument(
+        "--save", help="Save a checkpoint here at the end of a headless run"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default="equilibrium.ckpt",
+        help="File used by the K (save) and L (load) keys",
+    )
+    parser.add_argument(
+        "--vectorized",
+        action="store_true",
+        help="Compute the forces, motion and hunger of the animals with NumPy",
+    )
+    parser.add_argument(
+        "--telemetry",
+        help="Append population counts, births, deaths and the player's actions "
+        "to this CSV file",
+    )
+    parser.add_argument(
+        "--agents",
+        type=int,
+        help="Initial number of agents, for a larger world than the default one",
+    )
+    parser.add_argument(
+        "--map-size",
+        type=int,
+        help="Side of the map, by default it grows with --agents to keep the "
+        "default density",
+    )
+    parser.add_argument(
+        "--max-per-type",
+        type=int,
+        help=f"Most agents of one species alive at once, by default {MAX_PER_TYPE} "
+        "or --agents if larger",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Run the simulation in a separate process and draw its snapshots",
+    )
     args = parser.parse_args()
-    if args.start_paused:
-        global SPEED_MULTIPLIER
-        SPEED_MULTIPLIER = 0
+    if args.headless:
+        run_headless(args)
+        return
     game = Game(args)
     arcade.run()
 
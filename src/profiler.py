@@ -0,0 +1,138 @@
+from arcade import Text, color
+from arcade.arcade_types import Point
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Tuple
+import time
+
+# Lightweight instrumentation of the phases of a frame. When disabled, start()
+# and stop() return right away, so the call sites can stay in the hot paths.
+
+# (phase, group), the group is an agent type or a plain string
+Key = Tuple[str, object]
+
+
+def group_name(group: object) -> str:
+    return getattr(group, "__name__", str(group))
+
+
+class Profiler:
+    enabled: bool = False
+    window: int
+    current: Dict[Key, float]
+    history: Dict[Key, Deque[float]]
+    sums: Dict[Key, float]
+
+    def __init__(self, window: int = 60) -> None:
+        self.window = window
+        self.current = defaultdict(float)
+        self.history = {}
+        self.sums = defaultdict(float)
+
+    def start(self) -> float:
+        return time.perf_counter() if self.enabled else 0.0
+
+    # Adds the time since `start` to the phase, for the given group
+    def stop(self, phase: str, group: object, start: float) -> None:
+        if self.enabled:
+            self.current[(phase, group)] += time.perf_counter() - start
+
+    def toggle(self) -> None:
+        self.enabled = not self.enabled
+        self.current.clear()
+        self.history.clear()
+        self.sums.clear()
+
+    def end_frame(self) -> None:
+        if not self.enabled:
+            return
+        for key in self.current.keys() | self.history.keys():
+            samples = self.history.setdefault(key, deque())
+            value = self.current.get(key, 0.0)
+            samples.append(value)
+            self.sums[key] += value
+            if len(samples) > self.window:
+                self.sums[key] -= samples.popleft()
+        self.current.clear()
+
+    # Rolling average in ms per frame
+    def average(self, phase: str, group: object) -> float:
+        samples = self.history.get((phase, group))
+        if not samples:
+            return 0.0
+        return self.sums[(phase, group)] / len(samples) * 1000
+
+    def groups(self, phase: str) -> List[object]:
+        return sorted((g for (p, g) in self.history if p == phase), key=group_name)
+
+
+PROFILER = Profiler()
+
+# Phases shown in the HUD, in order. An agent's update includes its forces and
+# find_close calls, what is left of it is the state machines and bookkeeping,
+# which also covers the agents it creates or kills.
+HUD_PHASES = [
+    ("tick", "Whole ticks"),
+    ("kernel", "Batched kernel"),
+    ("forces", "Forces"),
+    ("find_close", "find_close"),
+    ("state", "State machines & rest"),
+    ("bounds", "Grid & boundaries"),
+    ("create", "create_agent"),
+    ("kill", "kill"),
+    ("draw", "Drawing"),
+]
+NESTED_IN_UPDATE = ["forces", "find_close"]
+
+
+class ProfilerHud:
+    LINE_SIZE: int = 14
+    REFRESH: float = 0.25
+    top_left: Point
+    lines: List[Text]
+    time_to_refresh: float = 0
+
+    def __init__(self, top_left: Point) -> None:
+        self.top_left = top_left
+        self.lines = [
+            Text(
+                "",
+                top_left[0],
+                top_left[1] - i * self.LINE_SIZE,
+                color.BLACK,
+                self.LINE_SIZE - 4,
+            )
+            for i in range(len(HUD_PHASES) + 1)
+        ]
+
+    def state_average(self, group: object) -> float:
+        return PROFILER.average("update", group) - sum(
+            PROFILER.average(phase, group) for phase in NESTED_IN_UPDATE
+        )
+
+    def describe(self, phase: str) -> Tuple[float, List[Tuple[object, float]]]:
+        if phase == "state":
+            parts = [(g, self.state_average(g)) for g in PROFILER.groups("update")]
+        else:
+            parts = [(g, PROFILER.average(phase, g)) for g in PROFILER.groups(phase)]
+        return (sum(ms for (_, ms) in parts), parts)
+
+    def refresh(self) -> None:
+        self.lines[0].text = "Profiler, ms per frame (F3 to hide):"
+        for line, (phase, name) in zip(self.lines[1:], HUD_PHASES):
+            total, parts = self.describe(phase)
+            breakdown = ", ".join(
+                f"{group_name(g)[:4]} {ms:.2f}" for (g, ms) in parts if ms >= 0.01
+            )
+            line.text = f"{name}: {total:.2f}" + (
+                f" ({breakdown})" if breakdown else ""
+            )
+
+    def update(self, delta_time: float) -> None:
+        self.time_to_refresh -= delta_time
+        if self.time_to_refresh <= 0:
+            self.time_to_refresh = self.REFRESH
+            self.refresh()
+
+    def draw(self) -> None:
+        for line in self.lines:
+            line.draw()
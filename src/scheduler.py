@@ -0,0 +1,41 @@
+from constants import DT
+from typing import Callable
+import time
+
+
+# Runs fixed DT steps so that simulated time follows wall time times `speed`,
+# but never spends more than `budget` seconds per frame doing so. Fractions of
+# a step are carried over to the next frame; a backlog that did not fit in the
+# budget is dropped, so the simulation slows down instead of the window.
+class FixedStepScheduler:
+    speed: float
+    budget: float
+    accumulator: float = 0.0
+    # Smoothed simulated seconds per wall second actually reached
+    achieved: float = 0.0
+    SMOOTHING: float = 0.1
+
+    def __init__(self, speed: float, budget: float = 0.010) -> None:
+        self.speed = speed
+        self.budget = budget
+
+    def set_speed(self, speed: float) -> None:
+        self.speed = max(0.0, speed)
+        if self.speed == 0:
+            self.accumulator = 0.0
+
+    # Returns how many steps were run
+    def advance(self, delta_time: float, step: Callable[[], None]) -> int:
+        self.accumulator += delta_time * self.speed
+        start = time.perf_counter()
+        steps = 0
+        while self.accumulator >= DT:
+            step()
+            steps += 1
+            self.accumulator -= DT
+            if time.perf_counter() - start >= self.budget:
+                self.accumulator = min(self.accumulator, DT)
+                break
+        if delta_time > 0:
+            self.achieved += (steps * DT / delta_time - self.achieved) * self.SMOOTHING
+        return steps
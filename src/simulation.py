@@ -0,0 +1,187 @@
+from agents import Map, Agent, Grass, Herbivore, Carnivore, Carcass
+from common import Updatable
+from constants import DT, MAP_SIZE, MAX_PER_TYPE
+from kernels import update_movers
+from profiler import PROFILER
+from telemetry import Telemetry
+from events import EventBus
+from typing import Callable, List, Optional, Tuple, Type
+import argparse
+import time
+
+SPECIES: List[Type[Agent]] = [Grass, Herbivore, Carnivore]
+
+# Class attributes the player can tune, as (class, field, name, min, max)
+PARAMETERS: List[Tuple[Type[Agent], str, str, float, float]] = [
+    (agent, name, f"{agent.__name__} {desc}", min_, max_)
+    for (name, desc, min_, max_) in [
+        ("hunger_buildup", "hunger increase", 1, 10),
+        ("hunger_damage", "damage from hunger", 5, 25),
+        ("satisfied_health_regen", "health regen when well-fed", 1, 10),
+        ("mean_age", "mean lifespan", 50, 300),
+        ("procreate_mean", "mean procreation time", 50, 300),
+        ("health_to_hunger", "feeding efficiency", 0.5, 1.5),
+        ("mean_attack_damage", "mean attack damage", 5, 50),
+    ]
+    for agent in (Herbivore, Carnivore)
+] + [
+    (Carnivore, "mean_chase_speed", "Carnivore mean chase speed", 0.5, 3),
+    (Grass, "mean_age", "Grass mean lifespan", 100, 2000),
+    (Carcass, "mean_rot_speed", "Carcass mean rot speed", 1, 20),
+]
+
+
+# Keeps the density of the default 1000x1000 map with 200 agents
+def map_size(total: int) -> int:
+    return max(MAP_SIZE, int(MAP_SIZE * (total / 200) ** 0.5))
+
+
+# The cap asked for, otherwise the default one or, for a larger world, the
+# initial number of agents
+def max_per_type(args: argparse.Namespace) -> int:
+    if args.max_per_type is not None:
+        return args.max_per_type
+    return max(MAX_PER_TYPE, args.agents or 0)
+
+
+# Everything that advances the ecosystem, independent of any window
+class Simulation:
+    map: Map
+    time: float = 0
+    score: float = 0
+    time_no_modif: float = 0
+    ticks: int = 0
+    prev_count: List[float]
+    # Updated once per tick, after the map
+    updatables: List[Updatable]
+    on_extinction: Callable[[Type[Agent]], None]
+    telemetry: Optional[Telemetry] = None
+    # Given to every map, flushed after each tick
+    events: EventBus
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.prev_count = [0, 0, 0]
+        self.updatables = []
+        self.on_extinction = lambda agent: None
+        self.vectorized = args.vectorized
+        self.max_per_type = max_per_type(args)
+        self.events = EventBus()
+        if args.load is not None:
+            self.load_checkpoint(args.load)
+        else:
+            if args.herbivores_only:
+                (total, distribution) = (30, [0, 1, 0])
+            elif args.carnivores_only:
+                (total, distribution) = (20, [0, 0, 1])
+            else:
+                (total, distribution) = (50, [11, 5, 2])
+            if args.agents is not None:
+                total = args.agents
+            size = args.map_size if args.map_size is not None else map_size(total)
+            self.map = Map(size, self.max_per_type)
+            self.map.events = self.events
+            if self.vectorized:
+                self.map.kernel = update_movers
+            self.map.gen_random_agents(total, distribution)
+        # Only now, so the agents of the initial world are not counted as births
+        if args.telemetry is not None:
+            self.telemetry = Telemetry(self, self.events, SPECIES, args.telemetry)
+            self.updatables.append(self.telemetry)
+
+    def load_checkpoint(self, path: str) -> None:
+        self.map = Map.load_checkpoint(path)
+        # Whatever the cap, the agents saved are kept
+        self.map.max_per_type = max(
+            [self.max_per_type] + [len(self.map.agents(agent)) for agent in SPECIES]
+        )
+        self.map.events = self.events
+        if self.vectorized:
+            self.map.kernel = update_movers
+
+    def get_data(self) -> List[float]:
+        return [len(self.map.agents(agent)) for agent in SPECIES]
+
+    def step(self) -> None:
+        start = PROFILER.start()
+        self.map.update()
+        self.events.flush()
+        for updatable in self.updatables:
+            updatable.update()
+        PROFILER.stop("tick", "all", start)
+        self.ticks += 1
+        self.time += DT
+        self.time_no_modif += DT
+        self.score += DT
+
+    # Extinction and score bookkeeping, returns the current counts
+    def update_counts(self) -> List[float]:
+        new_count = self.get_data()
+        if min(*new_count) == 0:
+            self.score = 0
+        for i, agent_type in enumerate(SPECIES):
+            if new_count[i] == 0 and self.prev_count[i] != 0:
+                if self.telemetry is not None:
+                    self.telemetry.record("extinction", agent_type.__name__)
+                self.on_extinction(agent_type)
+        self.prev_count = new_count
+        return new_count
+
+    def record_modification(self, score_change: int = 10) -> None:
+        self.time_no_modif = 0
+        self.score = max(0, self.score - score_change)
+
+    # The player's actions, which count as modifications
+
+    def create_agent(self, x: float, y: float, agent: Type[Agent]) -> bool:
+        created = self.map.create_agent(x, y, agent)
+        # Between ticks, so its events go out now
+        self.events.flush()
+        if not created:
+            return False
+        self.record_modification()
+        if self.telemetry is not None:
+            self.telemetry.record("create", agent.__name__)
+        return True
+
+    def kill_at(self, x: float, y: float) -> List[Agent]:
+        killed = list(self.map.find_at_point(x, y))
+        for agent in killed:
+            agent.kill()
+            self.record_modification()
+            if self.telemetry is not None:
+                self.telemetry.record("kill", agent.type.__name__)
+        return killed
+
+    def set_param(
+        self, agent: Type[Agent], field: str, value: float, score_change: int
+    ) -> None:
+        setattr(agent, field, value)
+        self.record_modification(score_change)
+        if self.telemetry is not None:
+            self.telemetry.record("slider", f"{agent.__name__}.{field}={value:g}")
+
+    # Flushes the telemetry, if any
+    def close(self) -> None:
+        if self.telemetry is not None:
+            self.telemetry.close()
+
+
+def run_headless(args: argparse.Namespace) -> None:
+    sim = Simulation(args)
+    sim.on_extinction = lambda agent: print(
+        f"Extinction of {agent.__name__} at {sim.time:.1f}s"
+    )
+    sim.update_counts()
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        sim.step()
+        sim.update_counts()
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    for agent, count in zip(SPECIES, sim.get_data()):
+        print(f"{agent.__name__} total: {count}")
+    print(f"Simulated {sim.time:.1f}s, score: {sim.score:.0f}")
+    sim.close()
+    if args.save is not None:
+        sim.map.save_checkpoint(args.save)
+        print(f"Checkpoint saved to {args.save}")
+    print(f"{sim.ticks} ticks in {elapsed:.2f}s ({sim.ticks / elapsed:.1f} ticks/sec)")
@@ -1,5 +1,6 @@
 from arcade import Sprite, SpriteList, Text, color
 from typing import List, cast, Optional
+from textures import get_texture
 import arcade
 
 
@@ -8,9 +9,11 @@ class SliderButton(Sprite):
         self, left: float, top: float, height: float, increase: bool, parent: "Slider"
     ) -> None:
         super().__init__(
-            ":resources:onscreen_controls/shaded_light/%s.png"
-            % ("right" if increase else "left"),
             scale=height / 80.0,
+            texture=get_texture(
+                ":resources:onscreen_controls/shaded_light/%s.png"
+                % ("right" if increase else "left")
+            ),
         )
         self.increase: bool = increase
         self.parent: Slider = parent
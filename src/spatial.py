@@ -0,0 +1,251 @@
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar, Generic
+from arcade import Sprite
+from random import Random
+import bisect
+
+Cell = Tuple[int, int]
+S = TypeVar("S", bound=Sprite)
+
+# Rejections before pick weighs every sprite
+PICK_ATTEMPTS = 32
+# Cells per side of the blocks pick weighs far away sprites by
+BLOCK = 4
+
+
+# Uniform grid (cell list) of sprites, bucketed by their center. Queries only
+# look at the cells overlapping the query circle, so the cost depends on how
+# crowded the area is, not on how many sprites there are in total.
+class SpatialGrid(Generic[S]):
+    cell_size: float
+    cells: Dict[Cell, List[S]]
+    cell_of: Dict[S, Cell]
+    # Sprites in each block of BLOCK x BLOCK cells
+    blocks: Dict[Cell, int]
+    # Bounding box of every cell ever used, it never shrinks
+    min_cell: Cell = (0, 0)
+    max_cell: Cell = (-1, -1)
+
+    def __init__(self, cell_size: float) -> None:
+        self.cell_size = cell_size
+        self.cells = {}
+        self.cell_of = {}
+        self.blocks = {}
+
+    def key(self, x: float, y: float) -> Cell:
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def __len__(self) -> int:
+        return len(self.cell_of)
+
+    def __contains__(self, sprite: S) -> bool:
+        return sprite in self.cell_of
+
+    def insert(self, sprite: S) -> None:
+        cell = self.key(sprite.center_x, sprite.center_y)
+        self.cell_of[sprite] = cell
+        self.cells.setdefault(cell, []).append(sprite)
+        self.count(cell, 1)
+        self.extend(cell)
+
+    def count(self, cell: Cell, change: int) -> None:
+        block = (cell[0] // BLOCK, cell[1] // BLOCK)
+        count = self.blocks.get(block, 0) + change
+        if count == 0:
+            del self.blocks[block]
+        else:
+            self.blocks[block] = count
+
+    def extend(self, cell: Cell) -> None:
+        if self.max_cell[0] < self.min_cell[0]:
+            (self.min_cell, self.max_cell) = (cell, cell)
+            return
+        self.min_cell = (min(self.min_cell[0], cell[0]), min(self.min_cell[1], cell[1]))
+        self.max_cell = (max(self.max_cell[0], cell[0]), max(self.max_cell[1], cell[1]))
+
+    def remove(self, sprite: S) -> None:
+        cell = self.cell_of.pop(sprite, None)
+        if cell is None:
+            return
+        bucket = self.cells[cell]
+        bucket.remove(sprite)
+        if len(bucket) == 0:
+            del self.cells[cell]
+        self.count(cell, -1)
+
+    # Must be called after the sprite changes position
+    def move(self, sprite: S) -> None:
+        cell = self.key(sprite.center_x, sprite.center_y)
+        old = self.cell_of.get(sprite)
+        if old == cell or old is None:
+            return
+        self.remove(sprite)
+        self.cell_of[sprite] = cell
+        self.cells.setdefault(cell, []).append(sprite)
+        self.count(cell, 1)
+        self.extend(cell)
+
+    # All sprites whose center is at most `radius` away from (x, y)
+    def query(self, x: float, y: float, radius: float) -> Iterator[S]:
+        (x0, y0) = self.key(x - radius, y - radius)
+        (x1, y1) = self.key(x + radius, y + radius)
+        r2 = radius * radius
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket is None:
+                    continue
+                for s in bucket:
+                    (sx, sy) = s.position
+                    dx = sx - x
+                    dy = sy - y
+                    if dx * dx + dy * dy <= r2:
+                        yield s
+
+    # Same as query, with the squared distances, which it computes anyway
+    def query_distances(
+        self, x: float, y: float, radius: float
+    ) -> Tuple[List[S], List[float]]:
+        (x0, y0) = self.key(x - radius, y - radius)
+        (x1, y1) = self.key(x + radius, y + radius)
+        r2 = radius * radius
+        found: List[S] = []
+        distances: List[float] = []
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket is None:
+                    continue
+                for s in bucket:
+                    (sx, sy) = s.position
+                    dx = sx - x
+                    dy = sy - y
+                    d2 = dx * dx + dy * dy
+                    if d2 <= r2:
+                        found.append(s)
+                        distances.append(d2)
+        return (found, distances)
+
+    # One sprite that passes keep, picked with probability proportional to
+    # 1 / max(d², 1), d its distance to (x, y), or None if none passes. Those
+    # of the 3x3 cells around (x, y) are weighed one by one. Farther away it
+    # picks a square, a cell or further still a block, by its count times the
+    # weight of its closest point, then one of its sprites at random, which is
+    # kept with the probability its own weight is of that one, otherwise it all
+    # starts again. That is the same distribution as weighing every sprite,
+    # which is needed, as in 2D the sprites past any radius still hold a good
+    # part of the total inverse-square weight.
+    def pick(
+        self,
+        x: float,
+        y: float,
+        rng: Random,
+        keep: Optional[Callable[[S], bool]] = None,
+    ) -> Optional[S]:
+        if len(self.cells) == 0:
+            return None
+        (cx, cy) = self.key(x, y)
+        # Each with the sum of the weights up to it
+        near: List[S] = []
+        near_cumulative: List[float] = []
+        total = 0.0
+        for i in range(cx - 1, cx + 2):
+            for j in range(cy - 1, cy + 2):
+                for s in self.cells.get((i, j), ()):
+                    if keep is not None and not keep(s):
+                        continue
+                    (sx, sy) = s.position
+                    total += 1 / max((sx - x) * (sx - x) + (sy - y) * (sy - y), 1.0)
+                    near.append(s)
+                    near_cumulative.append(total)
+        near_total = total
+        # Squares of side `side` cells, by their first cell, with their count
+        # and the sum of the masses up to them. Row by row, so the order does
+        # not depend on the dicts'.
+        squares: List[Tuple[int, int, int]] = []
+        counts: List[int] = []
+        cumulative: List[float] = []
+        (x0, y0) = self.min_cell
+        (x1, y1) = self.max_cell
+        (bx, by) = (cx // BLOCK, cy // BLOCK)
+        # Cells of the 3x3 blocks around that are not near
+        rows = range(max(y0, (by - 1) * BLOCK), min(y1, (by + 2) * BLOCK - 1) + 1)
+        dy2 = [self.gap(y, j, 1) ** 2 for j in rows]
+        for i in range(max(x0, (bx - 1) * BLOCK), min(x1, (bx + 2) * BLOCK - 1) + 1):
+            dx2 = self.gap(x, i, 1) ** 2
+            for j, row_dy2 in zip(rows, dy2):
+                if cx - 1 <= i <= cx + 1 and cy - 1 <= j <= cy + 1:
+                    continue
+                bucket = self.cells.get((i, j))
+                if bucket is not None:
+                    total += len(bucket) / max(dx2 + row_dy2, 1.0)
+                    squares.append((i, j, 1))
+                    counts.append(len(bucket))
+                    cumulative.append(total)
+        # Blocks past those
+        rows = range(y0 // BLOCK, y1 // BLOCK + 1)
+        dy2 = [self.gap(y, j, BLOCK) ** 2 for j in rows]
+        for i in range(x0 // BLOCK, x1 // BLOCK + 1):
+            dx2 = self.gap(x, i, BLOCK) ** 2
+            for j, row_dy2 in zip(rows, dy2):
+                if bx - 1 <= i <= bx + 1 and by - 1 <= j <= by + 1:
+                    continue
+                count = self.blocks.get((i, j))
+                if count is not None:
+                    total += count / max(dx2 + row_dy2, 1.0)
+                    squares.append((i * BLOCK, j * BLOCK, BLOCK))
+                    counts.append(count)
+                    cumulative.append(total)
+        if total == 0:
+            return None
+        for _ in range(PICK_ATTEMPTS):
+            u = rng.random() * total
+            if u < near_total:
+                return near[bisect.bisect(near_cumulative, u)]
+            k = min(bisect.bisect(cumulative, u), len(squares) - 1)
+            s = self.nth(squares[k], int(rng.random() * counts[k]))
+            if keep is not None and not keep(s):
+                continue
+            previous = cumulative[k - 1] if k > 0 else near_total
+            bound = (cumulative[k] - previous) / counts[k]
+            (sx, sy) = s.position
+            d2 = (sx - x) * (sx - x) + (sy - y) * (sy - y)
+            if rng.random() * bound < 1 / max(d2, 1.0):
+                return s
+        # Mostly rejected, as when few far sprites pass keep, so every one is
+        # weighed after all. This is still the same distribution.
+        candidates = near + [
+            s
+            for square in squares
+            for bucket in self.buckets(square)
+            for s in bucket
+            if keep is None or keep(s)
+        ]
+        if len(candidates) == 0:
+            return None
+        weights = []
+        for s in candidates:
+            (sx, sy) = s.position
+            weights.append(1 / max((sx - x) * (sx - x) + (sy - y) * (sy - y), 1.0))
+        return rng.choices(candidates, weights)[0]
+
+    # From x to the span of `side` cells starting at the i * side-th, along an
+    # axis
+    def gap(self, x: float, i: int, side: int) -> float:
+        span = side * self.cell_size
+        return max(i * span - x, x - (i + 1) * span, 0.0)
+
+    def buckets(self, square: Tuple[int, int, int]) -> Iterator[List[S]]:
+        (i0, j0, side) = square
+        for i in range(i0, i0 + side):
+            for j in range(j0, j0 + side):
+                bucket = self.cells.get((i, j))
+                if bucket is not None:
+                    yield bucket
+
+    # The n-th sprite of a square, counting its cells row by row
+    def nth(self, square: Tuple[int, int, int], n: int) -> S:
+        for bucket in self.buckets(square):
+            if n < len(bucket):
+                return bucket[n]
+            n -= len(bucket)
+        raise IndexError(n)
@@ -0,0 +1,221 @@
+import agents
+from agents import Agent
+from simulation import Simulation, SPECIES, PARAMETERS
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from random import Random
+from typing import Dict, Iterator, List, Set, Tuple, Type
+import argparse
+import csv
+import itertools
+import os
+
+# Runs many independent headless simulations over combinations of the slider
+# parameters, appending one CSV row per finished run.
+
+
+def param_key(agent: Type[Agent], field: str) -> str:
+    return f"{agent.__name__}.{field}"
+
+
+PARAMETERS_BY_KEY: Dict[str, Tuple[Type[Agent], str, str, float, float]] = {
+    param_key(p[0], p[1]): p for p in PARAMETERS
+}
+# Captured at import, before any run changes them
+DEFAULTS: Dict[str, float] = {
+    key: getattr(agent, field)
+    for (key, (agent, field, _, _, _)) in PARAMETERS_BY_KEY.items()
+}
+
+
+@dataclass
+class RunSpec:
+    run_id: int
+    seed: int
+    values: Dict[str, float]
+
+
+def grid_values(keys: List[str], steps: int) -> Iterator[Dict[str, float]]:
+    axes = []
+    for key in keys:
+        _, _, _, min_, max_ = PARAMETERS_BY_KEY[key]
+        if steps == 1:
+            axes.append([(min_ + max_) / 2])
+        else:
+            axes.append([min_ + (max_ - min_) * i / (steps - 1) for i in range(steps)])
+    for combination in itertools.product(*axes):
+        yield dict(zip(keys, combination))
+
+
+def random_values(keys: List[str], runs: int, seed: int) -> Iterator[Dict[str, float]]:
+    rng = Random(seed)
+    for _ in range(runs):
+        values = {}
+        for key in keys:
+            _, _, _, min_, max_ = PARAMETERS_BY_KEY[key]
+            values[key] = rng.uniform(min_, max_)
+        yield values
+
+
+def gen_runs(args: argparse.Namespace) -> Iterator[RunSpec]:
+    if args.mode == "grid":
+        points: Iterator[Dict[str, float]] = grid_values(args.params, args.steps)
+    else:
+        points = random_values(args.params, args.runs, args.seed)
+    run_id = 0
+    for values in points:
+        for _ in range(args.repeats):
+            yield RunSpec(run_id, args.seed + run_id, values)
+            run_id += 1
+
+
+def run_one(
+    spec: RunSpec, ticks: int, vectorized: bool, stop_on_extinction: bool
+) -> Dict[str, object]:
+    for key, default in DEFAULTS.items():
+        agent, field, _, _, _ = PARAMETERS_BY_KEY[key]
+        setattr(agent, field, spec.values.get(key, default))
+    agents.R.seed(spec.seed)
+    sim = Simulation(
+        argparse.Namespace(
+            herbivores_only=False,
+            carnivores_only=False,
+            vectorized=vectorized,
+            load=None,
+            telemetry=None,
+            agents=None,
+            map_size=None,
+            max_per_type=None,
+        )
+    )
+    first_extinction: List[Tuple[float, str]] = []
+    sim.on_extinction = lambda agent: first_extinction.append(
+        (sim.time, agent.__name__)
+    )
+    sim.update_counts()
+    while sim.ticks < ticks and not (stop_on_extinction and first_extinction):
+        sim.step()
+        sim.update_counts()
+    counts = sim.get_data()
+    row: Dict[str, object] = {"run_id": spec.run_id, "seed": spec.seed}
+    row.update(spec.values)
+    row["first_extinction"] = first_extinction[0][0] if first_extinction else ""
+    row["extinct"] = first_extinction[0][1] if first_extinction else ""
+    for agent, count in zip(SPECIES, counts):
+        row[agent.__name__] = count
+    row["score"] = round(sim.score, 2)
+    row["simulated"] = round(sim.time, 2)
+    return row
+
+
+# The rows already in the file by run_id, whose columns must be `fields`
+def read_done(path: str, fields: List[str]) -> Dict[int, Dict[str, str]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames is not None and reader.fieldnames != fields:
+            raise ValueError(
+                f"{path} has the columns {','.join(reader.fieldnames)}, "
+                "run it with the same --params or use another --out"
+            )
+        return {int(row["run_id"]): row for row in reader}
+
+
+# Whether a row in the file is the result of spec, and not of a run with the
+# same id from a sweep with another --seed or --mode
+def same_run(row: Dict[str, str], spec: RunSpec) -> bool:
+    return int(row["seed"]) == spec.seed and all(
+        float(row[key]) == value for key, value in spec.values.items()
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Parallel sweep over the slider parameters"
+    )
+    parser.add_argument("--mode", choices=["grid", "random"], default="random")
+    parser.add_argument(
+        "--params",
+        nargs="+",
+        choices=list(PARAMETERS_BY_KEY),
+        default=list(PARAMETERS_BY_KEY),
+        metavar="CLASS.FIELD",
+        help="Parameters to vary, the others keep their defaults",
+    )
+    parser.add_argument("--steps", type=int, default=3, help="Grid points per axis")
+    parser.add_argument("--runs", type=int, default=100, help="Random samples")
+    parser.add_argument("--repeats", type=int, default=1, help="Seeds per point")
+    parser.add_argument("--ticks", type=int, default=60 * 60 * 10)
+    parser.add_argument(
+        "--run-past-extinction",
+        action="store_true",
+        help="Keep simulating after the first extinction",
+    )
+    parser.add_argument("--seed", type=int, default=2014)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--vectorized", action="store_true")
+    parser.add_argument("--out", default="sweep.csv")
+    args = parser.parse_args()
+
+    fields = (
+        ["run_id", "seed"]
+        + args.params
+        + ["first_extinction", "extinct"]
+        + [agent.__name__ for agent in SPECIES]
+        + ["score", "simulated"]
+    )
+    # Runs already in the file are skipped, so an interrupted sweep can resume
+    try:
+        done = read_done(args.out, fields)
+    except ValueError as e:
+        parser.error(str(e))
+    last = max(done, default=-1)
+    for spec in gen_runs(args):
+        if spec.run_id > last:
+            break
+        if spec.run_id in done and not same_run(done[spec.run_id], spec):
+            parser.error(
+                f"run {spec.run_id} in {args.out} has another seed or parameter "
+                "values, run it with the same --seed and --mode or use another --out"
+            )
+    pending = (spec for spec in gen_runs(args) if spec.run_id not in done)
+    is_new = not os.path.exists(args.out) or os.path.getsize(args.out) == 0
+    finished = 0
+    with open(args.out, "a", newline="") as f, ProcessPoolExecutor(
+        args.workers
+    ) as executor:
+        writer = csv.DictWriter(f, fields)
+        if is_new:
+            writer.writeheader()
+        running: Set[Future] = set()
+        try:
+            while True:
+                # Keep a bounded number of runs queued, the sweep may be huge
+                for spec in itertools.islice(pending, 2 * args.workers - len(running)):
+                    running.add(
+                        executor.submit(
+                            run_one,
+                            spec,
+                            args.ticks,
+                            args.vectorized,
+                            not args.run_past_extinction,
+                        )
+                    )
+                if len(running) == 0:
+                    break
+                completed, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    writer.writerow(future.result())
+                    finished += 1
+                f.flush()
+                print(f"\r{finished} runs finished", end="", flush=True)
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            print(f"\nInterrupted, {finished} new runs saved to {args.out}")
+            return
+    print(f"\nDone, results in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
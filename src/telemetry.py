@@ -0,0 +1,117 @@
+from agents import Agent, DeathReason
+from collections import Counter
+from events import EventBus, Birth, Death
+from common import Updatable
+from constants import DT
+from queue import Queue
+from threading import Thread
+from typing import TYPE_CHECKING, Counter as CounterType, List, Optional, Type, Tuple
+import csv
+
+if TYPE_CHECKING:
+    from simulation import Simulation
+
+# Appends what happens in a Simulation to a CSV file. Every `interval` seconds
+# of simulated time there is a "counts" row with the populations, births and
+# deaths by reason since the previous one; slider changes, manual creations and
+# kills and extinctions get their own rows as they happen. Rows are handed to
+# a writer thread in batches, so the ticks never wait on the disk.
+
+Row = List[object]
+
+
+class Telemetry(Updatable):
+    sim: "Simulation"
+    interval: float
+    time_till_collect: float
+    # Rows not yet handed to the writer
+    pending: List[Row]
+    # Batches of rows, None to stop
+    queue: "Queue[Optional[List[Row]]]"
+    thread: Thread
+    species: List[Type[Agent]]
+    # Since the last counts row
+    births: CounterType[Type[Agent]]
+    deaths: CounterType[Tuple[Type[Agent], DeathReason]]
+
+    def __init__(
+        self,
+        sim: "Simulation",
+        events: EventBus,
+        species: List[Type[Agent]],
+        path: str,
+        interval: float = 1.0,
+    ) -> None:
+        self.sim = sim
+        self.species = species
+        self.interval = interval
+        self.time_till_collect = interval
+        self.pending = []
+        self.births = Counter()
+        self.deaths = Counter()
+        events.subscribe(Birth, self.on_births)
+        events.subscribe(Death, self.on_deaths)
+        self.queue = Queue()
+        self.file = open(path, "a", newline="")
+        self.thread = Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+        # Runs appended to an existing file share its header
+        if self.file.tell() == 0:
+            self.pending.append(
+                ["time", "kind", "detail"]
+                + [agent.__name__ for agent in species]
+                + [f"births_{agent.__name__}" for agent in species]
+                + [
+                    f"deaths_{agent.__name__}_{reason.name}"
+                    for agent in species
+                    for reason in DeathReason
+                ]
+            )
+
+    def write_loop(self) -> None:
+        writer = csv.writer(self.file)
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            writer.writerows(batch)
+            self.file.flush()
+        self.file.close()
+
+    def on_births(self, births: List[Birth]) -> None:
+        self.births.update(birth.agent for birth in births)
+
+    def on_deaths(self, deaths: List[Death]) -> None:
+        self.deaths.update((death.agent, death.reason) for death in deaths)
+
+    def record(self, kind: str, detail: str) -> None:
+        self.pending.append([round(self.sim.time, 3), kind, detail])
+
+    def counts_row(self) -> Row:
+        births, deaths = (self.births, self.deaths)
+        self.births = Counter()
+        self.deaths = Counter()
+        return (
+            [round(self.sim.time, 3), "counts", ""]
+            + self.sim.get_data()
+            + [births.get(agent, 0) for agent in self.species]
+            + [
+                deaths.get((agent, reason), 0)
+                for agent in self.species
+                for reason in DeathReason
+            ]
+        )
+
+    def update(self) -> None:
+        self.time_till_collect -= DT
+        if self.time_till_collect <= 0:
+            self.time_till_collect += self.interval
+            self.pending.append(self.counts_row())
+            self.queue.put(self.pending)
+            self.pending = []
+
+    def close(self) -> None:
+        if len(self.pending) > 0:
+            self.queue.put(self.pending)
+        self.queue.put(None)
+        self.thread.join()
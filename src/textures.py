@@ -0,0 +1,21 @@
+from arcade import Texture, load_texture
+from typing import Dict, Iterable
+
+# Textures by image, each loaded once. arcade has its own cache, but finding a
+# texture there means resolving the resource path and building the cache key
+# for every sprite. The hit box is computed with the texture, so it is shared
+# too.
+TEXTURES: Dict[str, Texture] = {}
+
+
+def get_texture(image: str) -> Texture:
+    texture = TEXTURES.get(image)
+    if texture is None:
+        texture = load_texture(image, hit_box_algorithm="Simple")
+        TEXTURES[image] = texture
+    return texture
+
+
+def preload(images: Iterable[str]) -> None:
+    for image in images:
+        get_texture(image)
@@ -0,0 +1,394 @@
+import agents
+from agents import ALL_AGENTS, Agent, AgentWithHealth, Map
+from benchmark import MIXES
+from checkpoint import (
+    RECORD,
+    STATES,
+    agent_record,
+    apply_record,
+    restore_agent,
+    timers_of,
+)
+from constants import INTERACTION_RADIUS, MAX_PER_TYPE
+from dataclasses import dataclass, field
+from kernels import update_movers
+from simulation import map_size
+from typing import Dict, List, Optional, Set, Tuple, cast
+import argparse
+import hashlib
+import multiprocessing
+import struct
+import time
+
+# One large headless world split over processes. The map is cut into vertical
+# strips and each process updates the agents whose center is in its strip.
+# After every tick a strip sends each of its neighbours:
+# - its agents that crossed into the neighbour's strip, which it now owns;
+# - its agents up to INTERACTION_RADIUS from their border, the halo, which
+#   the neighbour keeps as ghosts: in the grids, so queries and the force
+#   kernel see them, but never updated;
+# - the health its agents took from the neighbour's ghosts.
+# Agents go as checkpoint records with a global id in front, which keeps a
+# ghost, and whoever targets it, on the same object from tick to tick.
+#
+# This is not the same simulation as a single Map: the halo is a tick old,
+# damage to a ghost reaches its owner a tick later, searches without a
+# maximum distance see no farther than the halo and the cap on each species
+# is split evenly between the strips. For a fixed seed and number of strips
+# the result is always the same.
+
+HALO = INTERACTION_RADIUS
+UID = struct.Struct("<q")
+# An id followed by a checkpoint record
+TILE_RECORD = struct.Struct("<q" + RECORD.format[1:])
+
+
+@dataclass
+class Exchange:
+    sender: int
+    handovers: bytes = b""
+    halo: bytes = b""
+    # Ids of the previous halo that are not in this one
+    gone: List[int] = field(default_factory=list)
+    # (id, health) taken from the receiver's agents
+    damage: List[Tuple[int, float]] = field(default_factory=list)
+
+
+# A Map owning the agents of one strip, plus ghosts of its neighbours' ones
+class TileMap(Map):
+    index: int
+    count: int
+    # Ids of the agents it owns and of its ghosts, both ways
+    uids: Dict[Agent, int]
+    by_uid: Dict[int, Agent]
+    ghosts: Dict[int, AgentWithHealth]
+    # Ids made here are next_uid * count + index, unique across the strips
+    next_uid: int = 0
+
+    def __init__(self, size: int, max_per_type: int, index: int, count: int) -> None:
+        super().__init__(size, max_per_type)
+        self.index = index
+        self.count = count
+        self.uids = {}
+        self.by_uid = {}
+        self.ghosts = {}
+
+    def assign(self, agent: Agent, uid: int) -> None:
+        self.uids[agent] = uid
+        self.by_uid[uid] = agent
+
+    def forget(self, agent: Agent) -> None:
+        uid = self.uids.pop(agent, None)
+        if uid is not None:
+            del self.by_uid[uid]
+
+    def add_agent(self, obj: Agent) -> None:
+        super().add_agent(obj)
+        self.assign(obj, self.next_uid * self.count + self.index)
+        self.next_uid += 1
+
+    def release(self, agent: Agent) -> None:
+        self.forget(agent)
+        super().release(agent)
+
+    # Takes an agent handed over by another strip, which is not a birth
+    def adopt(self, agent: Agent) -> None:
+        self.scene.add_sprite(agent.type.__name__, agent)
+        self.grids[agent.type].insert(agent)
+        self.wake(agent)
+        for timer in timers_of(agent):
+            self.timers.push(timer)
+
+
+# What one strip sends and receives
+class Tile:
+    map: TileMap
+    # The strip is left <= x < right, the ones at the ends also own what went
+    # past the edges of the map
+    left: float
+    right: float
+    width: float
+    neighbours: List[int]
+    # Strip owning each ghost, and the ghost's health when it was last synced
+    owner: Dict[int, int]
+    synced: Dict[int, float]
+    # Ids in the last halo sent to each neighbour
+    sent: Dict[int, Set[int]]
+
+    def __init__(self, map: TileMap) -> None:
+        self.map = map
+        self.width = map.width / map.count
+        self.left = map.left + map.index * self.width
+        self.right = self.left + self.width
+        self.neighbours = [
+            i for i in (map.index - 1, map.index + 1) if 0 <= i < map.count
+        ]
+        self.owner = {}
+        self.synced = {}
+        self.sent = {i: set() for i in self.neighbours}
+
+    def strip_of(self, x: float) -> int:
+        return min(self.map.count - 1, max(0, int((x - self.map.left) // self.width)))
+
+    # Targets are written as ids
+    def record(self, agent: Agent) -> bytes:
+        return UID.pack(self.map.uids[agent]) + agent_record(
+            agent, self.map.uids, -1, 0
+        )
+
+    # Whether x is in the halo the neighbour sends, so a ghost there is kept
+    # up to date
+    def near(self, neighbour: int, x: float) -> bool:
+        if neighbour < self.map.index:
+            return self.left - HALO <= x < self.left + HALO
+        return self.right - HALO <= x < self.right + HALO
+
+    def add_ghost(self, uid: int, ghost: Agent, owner: int) -> None:
+        ghost = cast(AgentWithHealth, ghost)
+        self.map.grids[ghost.type].insert(ghost)
+        self.map.ghosts[uid] = ghost
+        self.owner[uid] = owner
+        self.synced[uid] = ghost.health
+
+    def drop_ghost(self, uid: int) -> None:
+        ghost = self.map.ghosts.pop(uid, None)
+        if ghost is None:
+            return
+        self.map.grids[ghost.type].remove(ghost)
+        self.map.forget(ghost)
+        del self.owner[uid]
+        del self.synced[uid]
+        # Whoever targets it gives up
+        ghost.health = 0
+
+    # Static agents that were not awake during the tick have not changed, so
+    # they are only sent when they enter the halo. Agents killed after their
+    # own update are neither handed over nor sent, their next update here
+    # takes care of their death, and killing them now would release them to
+    # the pool while still in use.
+    def collect(self, changed: Set[Agent]) -> Dict[int, Exchange]:
+        map = self.map
+        out = {i: Exchange(map.index) for i in self.neighbours}
+        owned = [
+            a
+            for agent in ALL_AGENTS
+            for a in cast(List[AgentWithHealth], map.agents(agent))
+            if not a.is_dead
+        ]
+        handovers: Dict[int, List[bytes]] = {i: [] for i in self.neighbours}
+        for a in owned:
+            x = a.center_x
+            strip = self.strip_of(x)
+            if strip == map.index:
+                continue
+            # Farther strips get it through the ones in between
+            neighbour = map.index + (1 if strip > map.index else -1)
+            handovers[neighbour].append(self.record(a))
+            uid = map.uids[a]
+            a.kill()
+            if self.near(neighbour, x):
+                self.add_ghost(uid, a, neighbour)
+            else:
+                map.forget(a)
+        halos: Dict[int, List[bytes]] = {i: [] for i in self.neighbours}
+        current: Dict[int, Set[int]] = {i: set() for i in self.neighbours}
+        low = map.index - 1 if map.index > 0 else None
+        high = map.index + 1 if map.index + 1 < map.count else None
+        for agent in ALL_AGENTS:
+            for a in cast(List[AgentWithHealth], map.agents(agent)):
+                if a.is_dead:
+                    continue
+                x = a.center_x
+                for i in (
+                    low if x < self.left + HALO else None,
+                    high if x >= self.right - HALO else None,
+                ):
+                    if i is None:
+                        continue
+                    uid = map.uids[a]
+                    current[i].add(uid)
+                    if agent.static and a not in changed and uid in self.sent[i]:
+                        continue
+                    halos[i].append(self.record(a))
+        for i, exchange in out.items():
+            exchange.handovers = b"".join(handovers[i])
+            exchange.halo = b"".join(halos[i])
+            exchange.gone = sorted(self.sent[i] - current[i])
+            self.sent[i] = current[i]
+        for uid, ghost in map.ghosts.items():
+            taken = self.synced[uid] - ghost.health
+            if taken > 0:
+                out[self.owner[uid]].damage.append((uid, taken))
+                self.synced[uid] = ghost.health
+        return out
+
+    # The exchanges of all neighbours, in order of sender. States go last, as
+    # their targets can come in any of them.
+    def apply(self, exchanges: List[Exchange]) -> None:
+        map = self.map
+        states: List[Tuple[Agent, Tuple, bool]] = []
+        for exchange in exchanges:
+            for uid, *values in TILE_RECORD.iter_unpack(exchange.handovers):
+                agent: Optional[Agent] = map.ghosts.pop(uid, None)
+                if agent is not None:
+                    map.grids[agent.type].remove(agent)
+                    del self.owner[uid]
+                    del self.synced[uid]
+                    apply_record(agent, values)
+                else:
+                    agent = restore_agent(map, values)
+                    map.assign(agent, uid)
+                map.adopt(agent)
+                states.append((agent, values, True))
+        for exchange in exchanges:
+            for uid in exchange.gone:
+                self.drop_ghost(uid)
+            for uid, *values in TILE_RECORD.iter_unpack(exchange.halo):
+                ghost = map.ghosts.get(uid)
+                if ghost is None:
+                    agent = restore_agent(map, values)
+                    map.assign(agent, uid)
+                    self.add_ghost(uid, agent, exchange.sender)
+                    ghost = map.ghosts[uid]
+                else:
+                    apply_record(ghost, values)
+                    map.grids[ghost.type].move(ghost)
+                    self.synced[uid] = ghost.health
+                states.append((ghost, values, False))
+            for uid, taken in exchange.damage:
+                target = map.by_uid.get(uid)
+                if target is not None and uid not in map.ghosts:
+                    cast(AgentWithHealth, target).remove_health(taken)
+        for agent, values, owned in states:
+            (state_i, _, target_i) = values[2:5]
+            if state_i < 0:
+                continue
+            state = STATES[state_i]
+            target = map.by_uid.get(target_i) if owned and target_i >= 0 else None
+            if owned and target is None and state.value != 0:
+                # Its target stayed behind, out of sight
+                agent.set_state(type(state)(0), map.time)  # type: ignore
+            else:
+                agent.set_state(state, values[-1], target)  # type: ignore
+
+
+# Entry point of the process of strip `index`
+def run_tile(
+    index: int, count: int, args: argparse.Namespace, queues, barrier, results
+) -> None:
+    size = args.map_size if args.map_size is not None else map_size(args.agents)
+    cap = max(MAX_PER_TYPE, args.agents)
+    map = TileMap(size, -(-cap // count), index, count)
+    tile = Tile(map)
+    if args.vectorized:
+        map.kernel = lambda m: update_movers(m, list(map.ghosts.values()))
+    # Every strip draws the whole world and keeps its part
+    agents.R.seed(args.seed)
+    (positions, types) = map.random_agents(args.agents, MIXES[args.mix])
+    agents.R.seed(f"{args.seed}-{index}")
+    mine = [i for i, (x, _) in enumerate(positions) if tile.strip_of(x) == index]
+    map.create_agents([positions[i] for i in mine], [types[i] for i in mine])
+
+    def exchange(changed: Set[Agent]) -> None:
+        for i, sent in tile.collect(changed).items():
+            queues[(index, i)].put(sent)
+        tile.apply([queues[(i, index)].get() for i in tile.neighbours])
+
+    exchange(set())
+    barrier.wait()
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        changed = {a for awake in map.awake.values() for a in awake}
+        map.update()
+        changed.update(a for awake in map.awake.values() for a in awake)
+        exchange(changed)
+    elapsed = time.perf_counter() - start
+    owned = sorted((map.uids[a], a) for agent in ALL_AGENTS for a in map.agents(agent))
+    digest = hashlib.sha1(b"".join(tile.record(a) for (_, a) in owned))
+    results.put(
+        (
+            index,
+            elapsed,
+            [len(map.agents(agent)) for agent in ALL_AGENTS],
+            digest.hexdigest(),
+        )
+    )
+
+
+def run(args: argparse.Namespace, count: int) -> Dict[str, object]:
+    context = multiprocessing.get_context("spawn")
+    # One per direction of each border, so a neighbour that is a tick ahead
+    # cannot be mistaken for another one
+    queues = {
+        (i, j): context.Queue()
+        for i in range(count)
+        for j in (i - 1, i + 1)
+        if 0 <= j < count
+    }
+    barrier = context.Barrier(count)
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=run_tile, args=(i, count, args, queues, barrier, results)
+        )
+        for i in range(count)
+    ]
+    for process in processes:
+        process.start()
+    outcome = sorted(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    elapsed = max(elapsed for (_, elapsed, _, _) in outcome)
+    return {
+        "workers": count,
+        "ticks_per_sec": round(args.ticks / elapsed, 2),
+        "counts": [
+            sum(counts[k] for (_, _, counts, _) in outcome)
+            for k in range(len(ALL_AGENTS))
+        ],
+        "digest": hashlib.sha1(
+            "".join(digest for (_, _, _, digest) in outcome).encode()
+        ).hexdigest()[:12],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a large world split over processes and compare speeds"
+    )
+    parser.add_argument("--agents", type=int, default=20000)
+    parser.add_argument("--mix", choices=list(MIXES), default="grass-heavy")
+    parser.add_argument("--map-size", type=int)
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=2014)
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=1,
+        help="Runs per number of workers, the fastest one is reported",
+    )
+    parser.add_argument("--vectorized", action="store_true")
+    args = parser.parse_args()
+    size = args.map_size if args.map_size is not None else map_size(args.agents)
+    if size / max(args.workers) < HALO:
+        parser.error(f"Strips must be at least {HALO} wide, the map is {size}")
+
+    print(f"{'workers':<10}{'ticks/s':>10}{'speedup':>10}  counts, digest")
+    first: Optional[float] = None
+    for count in args.workers:
+        runs = [run(args, count) for _ in range(args.repeats)]
+        result = max(runs, key=lambda r: cast(float, r["ticks_per_sec"]))
+        speed = cast(float, result["ticks_per_sec"])
+        if first is None:
+            first = speed
+        print(
+            f"{count:<10}{speed:>10}{speed / first:>10.2f}  "
+            f"{result['counts']}, {result['digest']}"
+        )
+        if len({r["digest"] for r in runs}) > 1:
+            print(f"Runs with {count} workers ended differently")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+from dataclasses import dataclass
+from typing import Callable, List, Tuple
+import heapq
+
+INF = float("inf")
+
+
+# Fires `callback` once `remaining` seconds of its own clock have passed. Its
+# clock runs at `rate` times the simulation time, 0 pauses it.
+@dataclass(eq=False)
+class Timer:
+    callback: Callable[[], None]
+    # Left at time `since`
+    remaining: float
+    since: float
+    rate: float
+    active: bool = True
+    # Simulation time it fires at, with the current rate
+    deadline: float = INF
+    # Of its entry in the heap, -1 if it has none
+    seq: int = -1
+
+
+# Deadlines in absolute simulation time, in a heap. Entries of timers that were
+# paused, rescheduled or cancelled are left in the heap and skipped when they
+# come out, which is cheaper than removing them.
+class TimerQueue:
+    time: float = 0.0
+    heap: List[Tuple[float, int, Timer]]
+    next_seq: int = 0
+
+    def __init__(self) -> None:
+        self.heap = []
+
+    def push(self, timer: Timer) -> None:
+        if not timer.active or timer.rate == 0:
+            timer.deadline = INF
+            timer.seq = -1
+            return
+        timer.deadline = timer.since + timer.remaining / timer.rate
+        timer.seq = self.next_seq
+        self.next_seq += 1
+        heapq.heappush(self.heap, (timer.deadline, timer.seq, timer))
+
+    def schedule(
+        self, delay: float, callback: Callable[[], None], rate: float = 1.0
+    ) -> Timer:
+        timer = Timer(callback, delay, self.time, rate)
+        self.push(timer)
+        return timer
+
+    # Starts a fired or cancelled timer again, keeping its rate
+    def restart(self, timer: Timer, delay: float) -> None:
+        timer.remaining = delay
+        timer.since = self.time
+        timer.active = True
+        self.push(timer)
+
+    def remaining(self, timer: Timer) -> float:
+        return timer.remaining - (self.time - timer.since) * timer.rate
+
+    def set_rate(self, timer: Timer, rate: float) -> None:
+        if rate == timer.rate:
+            return
+        timer.remaining = self.remaining(timer)
+        timer.since = self.time
+        timer.rate = rate
+        self.push(timer)
+
+    def cancel(self, timer: Timer) -> None:
+        timer.active = False
+        timer.seq = -1
+
+    # Moves the time forward and fires, in order, every timer that is due
+    def advance(self, dt: float) -> None:
+        self.time += dt
+        heap = self.heap
+        while len(heap) > 0 and heap[0][0] <= self.time:
+            (_, seq, timer) = heapq.heappop(heap)
+            if seq != timer.seq:
+                continue
+            timer.remaining = 0
+            timer.since = self.time
+            timer.active = False
+            timer.seq = -1
+            timer.callback()
@@ -0,0 +1,393 @@
+from agents import ALL_AGENTS, Agent, AgentWithHunger
+from arcade import Sprite, SpriteList
+from bars import BarBatch, BAR_HEIGHT
+from events import Cap
+from constants import DT, OBJ_SIZE, SCREEN_HEIGHT, SCREEN_WIDTH
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from scheduler import FixedStepScheduler
+from simulation import PARAMETERS, Simulation, max_per_type
+from textures import get_texture
+from typing import List, Optional, Tuple, Type
+import agents
+import arcade, arcade.color
+import argparse
+import checkpoint
+import multiprocessing
+import queue
+import struct
+import time
+
+# Runs the Simulation in another process so slow ticks don't stall the window.
+# After each batch of ticks the worker publishes a snapshot of every agent to a
+# shared memory buffer; the window only draws the latest one and sends the
+# player's actions back as commands, applied between ticks.
+
+# ticks, agent count, map size, time, score, time without modification,
+# achieved speed, the count of each of SPECIES, then the value of each of
+# PARAMETERS
+HEADER = struct.Struct(f"<QIIdddd3I{len(PARAMETERS)}d")
+# type, center x, center y, angle, health, hunger (-1 if it has none)
+RECORD = struct.Struct("<bfffff")
+
+
+@dataclass
+class CreateAgent:
+    x: float
+    y: float
+    agent: Type[Agent]
+
+
+@dataclass
+class KillAt:
+    x: float
+    y: float
+
+
+@dataclass
+class SetParam:
+    agent: Type[Agent]
+    field: str
+    value: float
+    score_change: int
+
+
+@dataclass
+class SetSpeed:
+    speed: float
+
+
+@dataclass
+class SaveCheckpoint:
+    path: str
+
+
+@dataclass
+class LoadCheckpoint:
+    path: str
+
+
+@dataclass
+class Stop:
+    pass
+
+
+Command = (
+    CreateAgent | KillAt | SetParam | SetSpeed | SaveCheckpoint | LoadCheckpoint | Stop
+)
+
+
+# Sent back to the window, kind is one of "created", "killed", "extinction",
+# "cap", "saved", "loaded", "error" or "resize", whose text is the name of the
+# shared buffer snapshots are published to from then on
+@dataclass
+class Event:
+    kind: str
+    text: str
+
+
+def buffer_size(max_per_type: int) -> int:
+    return HEADER.size + RECORD.size * max_per_type * len(ALL_AGENTS)
+
+
+# The cap the first buffer is sized for, which a loaded checkpoint may be over
+def initial_cap(args: argparse.Namespace) -> int:
+    cap = max_per_type(args)
+    if args.load is None:
+        return cap
+    try:
+        with open(args.load, "rb") as f:
+            return max(cap, checkpoint.live_count(f))
+    except (OSError, ValueError, struct.error):
+        # The worker fails to load it too and reports why
+        return cap
+
+
+def agent_record(agent: Agent) -> bytes:
+    return RECORD.pack(
+        ALL_AGENTS.index(agent.type),
+        agent.center_x,
+        agent.center_y,
+        agent.angle,
+        getattr(agent, "health", 0.0),
+        agent.hunger if isinstance(agent, AgentWithHunger) else -1.0,
+    )
+
+
+class Publisher:
+    memory: shared_memory.SharedMemory
+    capacity: int
+
+    def __init__(self, memory: shared_memory.SharedMemory, lock, events) -> None:
+        self.lock = lock
+        self.events = events
+        self.attach(memory)
+
+    def attach(self, memory: shared_memory.SharedMemory) -> None:
+        self.memory = memory
+        self.capacity = (memory.size - HEADER.size) // RECORD.size
+
+    def publish(self, sim: Simulation, achieved: float) -> None:
+        live = [a for agent in ALL_AGENTS for a in sim.map.agents(agent)]
+        # More than fit, as after loading a larger checkpoint. They all go to
+        # a new buffer, which the window switches to once it is written.
+        previous = None
+        if len(live) > self.capacity:
+            previous = self.memory
+            size = buffer_size(max(sim.map.max_per_type, len(live)))
+            self.attach(shared_memory.SharedMemory(create=True, size=size))
+        records = b"".join(agent_record(a) for a in live)
+        header = HEADER.pack(
+            sim.ticks,
+            len(live),
+            int(sim.map.width),
+            sim.time,
+            sim.score,
+            sim.time_no_modif,
+            achieved,
+            *(int(c) for c in sim.get_data()),
+            *(getattr(agent, field) for (agent, field, *_) in PARAMETERS),
+        )
+        with self.lock:
+            self.memory.buf[: HEADER.size] = header
+            self.memory.buf[HEADER.size : HEADER.size + len(records)] = records
+        if previous is not None:
+            self.events.put(Event("resize", self.memory.name))
+            previous.close()
+
+
+def apply(sim: Simulation, scheduler: FixedStepScheduler, command, events) -> None:
+    match command:
+        case CreateAgent(x, y, agent):
+            if sim.create_agent(x, y, agent):
+                events.put(Event("created", agent.__name__))
+        case KillAt(x, y):
+            for agent in sim.kill_at(x, y):
+                events.put(Event("killed", agent.__class__.__name__))
+        case SetParam(agent, field, value, score_change):
+            sim.set_param(agent, field, value, score_change)
+        case SetSpeed(speed):
+            scheduler.set_speed(speed)
+        case SaveCheckpoint(path):
+            try:
+                sim.map.save_checkpoint(path)
+            except OSError as e:
+                events.put(Event("error", f"Could not save {path}: {e}"))
+            else:
+                events.put(Event("saved", path))
+        case LoadCheckpoint(path):
+            try:
+                sim.load_checkpoint(path)
+            except (OSError, ValueError) as e:
+                events.put(Event("error", f"Could not load {path}: {e}"))
+            else:
+                sim.record_modification()
+                events.put(Event("loaded", path))
+
+
+# Entry point of the worker process
+def run(
+    args: argparse.Namespace,
+    commands,
+    events,
+    memory_name: str,
+    lock,
+    ready,
+    speed: float,
+) -> None:
+    publisher = Publisher(shared_memory.SharedMemory(memory_name), lock, events)
+    sim = Simulation(args)
+    sim.on_extinction = lambda agent: events.put(Event("extinction", agent.__name__))
+
+    def forward_caps(caps: List[Cap]) -> None:
+        for name in {cap.agent.__name__ for cap in caps}:
+            events.put(Event("cap", name))
+
+    sim.events.subscribe(Cap, forward_caps)
+    # Up to a whole frame per batch, nothing else runs in this process
+    scheduler = FixedStepScheduler(speed, budget=DT)
+    sim.update_counts()
+    publisher.publish(sim, 0)
+    ready.set()
+    last = time.perf_counter()
+    try:
+        while True:
+            # Commands only ever land between ticks
+            while True:
+                try:
+                    command = commands.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(command, Stop):
+                    return
+                apply(sim, scheduler, command, events)
+            now = time.perf_counter()
+            steps = scheduler.advance(now - last, sim.step)
+            last = now
+            sim.update_counts()
+            publisher.publish(sim, scheduler.achieved)
+            if steps == 0:
+                time.sleep(DT / 2)
+    finally:
+        sim.close()
+        publisher.memory.close()
+
+
+@dataclass
+class Snapshot:
+    ticks: int
+    map_size: int
+    time: float
+    score: float
+    time_no_modif: float
+    achieved: float
+    counts: List[float]
+    # The value of each of PARAMETERS
+    params: List[float]
+    # (type index, x, y, angle, health, hunger)
+    records: List[Tuple[int, float, float, float, float, float]]
+
+
+# The window's side: owns the process, the queues and the shared buffer
+class SimulationWorker:
+    process: multiprocessing.Process
+    memory: shared_memory.SharedMemory
+
+    def __init__(self, args: argparse.Namespace, speed: float) -> None:
+        context = multiprocessing.get_context("spawn")
+        self.commands = context.Queue()
+        self.events = context.Queue()
+        self.lock = context.Lock()
+        ready = context.Event()
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=buffer_size(initial_cap(args))
+        )
+        self.process = context.Process(
+            target=run,
+            args=(
+                args,
+                self.commands,
+                self.events,
+                self.memory.name,
+                self.lock,
+                ready,
+                speed,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+        # The window reads snapshots right away, so the first one must be real
+        while not ready.wait(0.1):
+            if not self.process.is_alive():
+                self.memory.close()
+                self.memory.unlink()
+                raise RuntimeError("The simulation process exited while starting")
+
+    def send(self, command: Command) -> None:
+        self.commands.put(command)
+
+    # Buffer changes are handled here, the rest is returned
+    def poll_events(self) -> List[Event]:
+        events = []
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                return events
+            if event.kind == "resize":
+                self.switch(event.text)
+            else:
+                events.append(event)
+
+    # The worker created it and no longer uses the current one
+    def switch(self, memory_name: str) -> None:
+        memory = shared_memory.SharedMemory(memory_name)
+        with self.lock:
+            (previous, self.memory) = (self.memory, memory)
+        previous.close()
+        previous.unlink()
+
+    def snapshot(self) -> Snapshot:
+        with self.lock:
+            header = HEADER.unpack_from(self.memory.buf)
+            count = header[1]
+            data = bytes(
+                self.memory.buf[HEADER.size : HEADER.size + count * RECORD.size]
+            )
+        return Snapshot(
+            header[0],
+            header[2],
+            *header[3:7],
+            list(header[7:10]),
+            list(header[10:]),
+            list(RECORD.iter_unpack(data)),
+        )
+
+    def stop(self) -> None:
+        self.send(Stop())
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        # So a buffer it created last is unlinked too
+        self.poll_events()
+        self.memory.close()
+        self.memory.unlink()
+
+
+# Draws a Snapshot with one reused sprite per agent
+class SnapshotView:
+    lists: List[SpriteList]
+    bars: BarBatch
+    map_size: int = 0
+    records: List[Tuple[int, float, float, float, float, float]]
+
+    def __init__(self) -> None:
+        self.lists = [SpriteList() for _ in ALL_AGENTS]
+        self.records = []
+        self.bars = BarBatch()
+
+    def update(self, snapshot: Snapshot) -> None:
+        self.map_size = snapshot.map_size
+        self.records = snapshot.records
+        by_type: List[List[Tuple]] = [[] for _ in ALL_AGENTS]
+        for record in snapshot.records:
+            by_type[record[0]].append(record)
+        for agent, sprites, records in zip(ALL_AGENTS, self.lists, by_type):
+            while len(sprites) < len(records):
+                sprites.append(
+                    Sprite(scale=OBJ_SIZE / 128, texture=get_texture(agent.image))
+                )
+            while len(sprites) > len(records):
+                sprites.pop()
+            # Each setter updates the sprite list, so angles, which rarely
+            # change, are only set when they do
+            for sprite, (_, x, y, angle, _, _) in zip(sprites, records):
+                sprite.position = (x, y)
+                if sprite.angle != angle:
+                    sprite.angle = angle
+
+    def draw_bars(self) -> None:
+        self.bars.begin()
+        for _, x, y, _, health, hunger in self.records:
+            left = x - OBJ_SIZE / 2
+            top = y + OBJ_SIZE / 2
+            self.bars.add(left, top, OBJ_SIZE * health / 100, arcade.color.GREEN)
+            if hunger >= 0:
+                self.bars.add(
+                    left, top + BAR_HEIGHT, OBJ_SIZE * hunger / 100, arcade.color.RED
+                )
+        self.bars.end()
+        self.bars.draw()
+
+    def draw(self) -> None:
+        arcade.draw_rectangle_filled(
+            SCREEN_WIDTH / 2,
+            SCREEN_HEIGHT / 2,
+            self.map_size,
+            self.map_size,
+            arcade.color.BLACK,
+        )
+        for sprites in self.lists:
+            sprites.draw()
+        if agents.SHOW_BARS:
+            self.draw_bars()